@@ -11,6 +11,7 @@ let showNodeId = false; // false = show title, true = show ID
 let selectedNodeForLink = null;
 let simulation = null;
 let nodePositions = {}; // Store node positions to preserve them between renders
+let serverLayoutApplied = false; // Every node got a precomputed position from the server
 let hoverTimer = null; // Timer for showing tooltip on hover
 
 // Theme initialization
@@ -168,8 +169,9 @@ function validateConnections(docId, nodeIds) {
     if (!graphConnections[docId]) return;
 
     // Remove connections where source or target node doesn't exist
+    const ids = new Set(nodeIds);
     graphConnections[docId] = graphConnections[docId].filter(conn => {
-        return nodeIds.includes(conn.source) && nodeIds.includes(conn.target);
+        return ids.has(conn.source) && ids.has(conn.target);
     });
     localStorage.setItem("graphConnections", JSON.stringify(graphConnections));
 }
@@ -341,10 +343,36 @@ function selectBook(book) {
     }
 
     updateStats();
-    renderGraph();
+    applyServerLayout(currentDocId).then(renderGraph);
+}
+
+// Use server-computed positions so large books render already laid out
+async function applyServerLayout(docId) {
+    serverLayoutApplied = false;
+    if (!docId) return;
+    try {
+        const res = await fetch(`/graph_layout/${encodeURIComponent(docId)}`);
+        if (!res.ok) return;
+        const layout = await res.json();
+        const { width, height } = getGraphDimensions();
+        let placed = 0;
+        graphData.nodes.forEach(n => {
+            const p = layout.nodes[n.id];
+            if (!p) return;
+            placed++;
+            // Keep positions the user already arranged in this session
+            if (!nodePositions[n.id]) {
+                nodePositions[n.id] = { x: width / 2 + p[0], y: height / 2 + p[1], vx: 0, vy: 0 };
+            }
+        });
+        serverLayoutApplied = placed === graphData.nodes.length;
+    } catch (err) {
+        console.warn('Server layout unavailable:', err);
+    }
 }
 
 function renderOverview() {
+    serverLayoutApplied = false;
     // Collect all nodes from all books
     graphData.nodes = [];
     const allNodeIds = new Set();
@@ -482,6 +510,11 @@ function renderGraph() {
             .iterations(4));
     }
 
+    // Pre-laid-out graphs only need a gentle settle
+    if (serverLayoutApplied && !overviewModeEnabled) {
+        simulation.alpha(0.05);
+    }
+
     // If was frozen, stop immediately
     if (isFrozen) {
         simulation.stop();
@@ -804,7 +804,13 @@ $(function () {
 
                 if (!res.ok) {
                     const error = await res.json();
-                    throw new Error(error.detail || "خطا در افزودن کتاب");
+                    const detail = error.detail;
+                    if (detail && typeof detail === "object") {
+                        // Batched validation errors: show the first few
+                        const lines = (detail.errors || []).slice(0, 5).map(e => `${e.path}: ${e.message}`);
+                        throw new Error(`${detail.message} (${detail.errorCount})\n${lines.join("\n")}`);
+                    }
+                    throw new Error(detail || "خطا در افزودن کتاب");
                 }
 
                 const result = await res.json();
@@ -4,13 +4,25 @@ Production Deployment Script for Rooster Data Prepare Tool
 Cross-platform compatible deployment script
 """
 
-import shutil
+import gzip
+import hashlib
+import json
+import os
+import re
+import struct
 import sys
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import zipfile
-from datetime import datetime
 import platform
 
+try:  # Optional: brotli variants are skipped when it is not installed
+    import brotli
+except ImportError:
+    brotli = None
+
 # Project structure
 REQUIRED_FILES = ["main.py", "index.html", "graph.html", "requirements.txt"]
 
@@ -22,9 +34,20 @@ OPTIONAL_DIRS = ["json_data", "backups"]
 
 PORT = 8014
 
+# Asset types worth shipping precompressed (.gz/.br) next to the original
+COMPRESSIBLE_SUFFIXES = {".js", ".css", ".html", ".svg", ".json", ".ttf"}
+
 # Deployment directory
 DEPLOY_DIR = Path("deploy")
 
+# Incremental builds: compressed variants cached by content hash, and the
+# per-file hashes of the last package to tell what changed
+BUILD_CACHE_DIR = DEPLOY_DIR / ".build_cache"
+BUILD_MANIFEST = DEPLOY_DIR / "build_manifest.json"
+
+# Top-level folder inside the zip; fixed so identical inputs give identical zips
+PACKAGE_ROOT = "rooster_deploy"
+
 
 def ensure_deploy_dir():
     """Ensure deploy directory exists"""
@@ -38,6 +61,10 @@ def create_requirements():
     requirements = """fastapi==0.104.1
 uvicorn[standard]==0.24.0
 python-multipart==0.0.6
+brotli==1.1.0
+numpy>=1.24
+pyarrow>=14.0
+gunicorn==21.2.0; sys_platform != "win32"
 """
 
     requirements_path = DEPLOY_DIR / "requirements.txt"
@@ -56,6 +83,24 @@ HOST = os.getenv("HOST", "0.0.0.0")
 PORT = int(os.getenv("PORT", {PORT}))
 WORKERS = int(os.getenv("WORKERS", 4))
 
+# Process manager: "gunicorn" (Linux/macOS) preloads the app and dataset in
+# the master before forking workers; "uvicorn" is used on Windows or as a
+# fallback and loads everything separately in each worker.
+SERVER = os.getenv("SERVER", "gunicorn")
+PRELOAD_APP = os.getenv("PRELOAD_APP", "1") == "1"
+
+# Worker recycling (gunicorn only): restart a worker after MAX_REQUESTS
+# (+ random jitter so they don't restart together) or once its memory
+# exceeds MAX_WORKER_MEMORY_MB (0 disables)
+MAX_REQUESTS = int(os.getenv("MAX_REQUESTS", 5000))
+MAX_REQUESTS_JITTER = int(os.getenv("MAX_REQUESTS_JITTER", 500))
+MAX_WORKER_MEMORY_MB = int(os.getenv("MAX_WORKER_MEMORY_MB", 0))
+
+# Graceful restarts: `kill -HUP <pid in PIDFILE>` replaces workers one by one,
+# giving in-flight requests GRACEFUL_TIMEOUT seconds to finish
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", 30))
+TIMEOUT = int(os.getenv("TIMEOUT", 120))
+
 # Security
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "*").split(",")
 
@@ -63,6 +108,7 @@ ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "*").split(",")
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 JSON_DATA_DIR = os.path.join(BASE_DIR, "json_data")
 BACKUPS_DIR = os.path.join(BASE_DIR, "backups")
+PIDFILE = os.path.join(BASE_DIR, "rooster.pid")
 """
 
     config_path = DEPLOY_DIR / "config.py"
@@ -78,14 +124,57 @@ def create_run_script():
 Production Runner for Rooster Data Prepare Tool
 """
 
+import gc
 import uvicorn
+import shutil
 import sys
 import os
 
 # Add current directory to Python path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+
+def run_gunicorn(config):
+    """Run under gunicorn with uvicorn workers, preloading the dataset."""
+    from gunicorn.app.base import BaseApplication
+
+    class RoosterApplication(BaseApplication):
+        def load_config(self):
+            options = {{
+                "bind": f"{{config.HOST}}:{{config.PORT}}",
+                "workers": config.WORKERS,
+                "worker_class": "uvicorn.workers.UvicornWorker",
+                "preload_app": config.PRELOAD_APP,
+                "max_requests": config.MAX_REQUESTS,
+                "max_requests_jitter": config.MAX_REQUESTS_JITTER,
+                "graceful_timeout": config.GRACEFUL_TIMEOUT,
+                "timeout": config.TIMEOUT,
+                "pidfile": config.PIDFILE,
+                "accesslog": "-",
+                "loglevel": "info",
+            }}
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            import main
+
+            if config.PRELOAD_APP:
+                # Parsed dataset is shared copy-on-write by all forked workers;
+                # freezing keeps the GC from touching (and copying) its pages
+                main.preload_dataset()
+                gc.freeze()
+            return main.app
+
+    RoosterApplication().run()
+
+
 if __name__ == "__main__":
+    # Drop metric snapshots of workers from the previous run
+    shutil.rmtree(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "metrics"),
+        ignore_errors=True,
+    )
     # Import config
     try:
         import config
@@ -95,6 +184,22 @@ if __name__ == "__main__":
             HOST = "0.0.0.0"
             PORT = {PORT}
             WORKERS = 4
+            SERVER = "uvicorn"
+
+    os.environ["ROOSTER_MAX_WORKER_MEMORY_MB"] = str(
+        getattr(config, "MAX_WORKER_MEMORY_MB", 0)
+    )
+
+    if config.SERVER == "gunicorn" and sys.platform != "win32":
+        try:
+            import gunicorn  # noqa: F401
+        except ImportError:
+            print("gunicorn not installed, falling back to uvicorn")
+        else:
+            run_gunicorn(config)
+            sys.exit(0)
+    # uvicorn cannot replace exited workers, so never recycle under it
+    os.environ["ROOSTER_MAX_WORKER_MEMORY_MB"] = "0"
 
     # Run the server
     uvicorn.run(
@@ -123,7 +228,7 @@ if __name__ == "__main__":
 def create_systemd_service():
     """Create systemd service file for Linux servers"""
     ensure_deploy_dir()
-    service_content = """[Unit]
+    service_content = f"""[Unit]
 Description=Rooster Data Prepare Tool
 After=network.target
 
@@ -133,6 +238,11 @@ User=www-data
 WorkingDirectory=/path/to/your/app
 Environment="PATH=/usr/local/bin:/usr/bin:/bin"
 ExecStart=/usr/bin/python3 /path/to/your/app/run_production.py
+# Only report the unit as started once the dataset is loaded (/ready)
+ExecStartPost=/bin/sh -c 'until curl -fs http://127.0.0.1:{PORT}/ready >/dev/null; do sleep 1; done'
+TimeoutStartSec=300
+# Rolling restart of the gunicorn workers without dropping requests
+ExecReload=/bin/kill -s HUP $MAINPID
 Restart=on-failure
 RestartSec=10
 
@@ -173,6 +283,10 @@ RUN mkdir -p json_data backups
 # Expose port
 EXPOSE {PORT}
 
+# Healthy only once the dataset warm-up has finished (/ready returns 200)
+HEALTHCHECK --interval=10s --timeout=3s --start-period=15s --retries=3 \\
+    CMD python -c "import os, urllib.request; urllib.request.urlopen('http://127.0.0.1:%s/ready' % os.getenv('PORT', '{PORT}'), timeout=2)" || exit 1
+
 # Run the application
 CMD ["python", "run_production.py"]
 """
@@ -222,6 +336,9 @@ services:
       - HOST=0.0.0.0
       - PORT={PORT}
       - WORKERS=4
+      - ROOSTER_PROFILING=0
+      - ROOSTER_PROFILE_SAMPLE_RATE=0
+      - ROOSTER_TIMING=0
     restart: unless-stopped
 """
 
@@ -264,11 +381,11 @@ def create_nginx_config():
         proxy_read_timeout 60s;
     }}
 
-    # Static files optimization (optional)
+    # Static files: the app sends precompressed variants and cache headers
+    # (content-hashed names are immutable, the rest revalidate)
     location /assets {{
         proxy_pass http://127.0.0.1:{PORT}/assets;
-        expires 30d;
-        add_header Cache-Control "public, immutable";
+        proxy_set_header Accept-Encoding $http_accept_encoding;
     }}
 }}"""
     nginx_path = DEPLOY_DIR / "nginx.conf"
@@ -374,38 +491,111 @@ echo   docker-compose up -d
     print(f"✓ Created {setup_path_windows}")
 
 
-def create_build_package():
-    """Create a deployable package"""
-    ensure_deploy_dir()
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    package_name = f"rooster_deploy_{timestamp}"
-    package_dir = DEPLOY_DIR / package_name
-
-    # Create package directory
-    package_dir.mkdir(exist_ok=True)
-
-    print(f"\n📦 Creating deployment package: {package_name}")
-
-    # Copy required files
+def compress_variants(data):
+    """.gz (and .br when available) encodings of data, cached by content.
+
+    Results live in BUILD_CACHE_DIR under the sha256 of the input, so
+    unchanged assets are never recompressed by later builds.
+    """
+    key = hashlib.sha256(data).hexdigest()
+    encoders = [(".gz", lambda: gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        encoders.append((".br", lambda: brotli.compress(data, quality=11)))
+    variants = []
+    for suffix, encode in encoders:
+        cache_path = BUILD_CACHE_DIR / f"{key}{suffix}"
+        if cache_path.exists():
+            compressed = cache_path.read_bytes()
+        else:
+            compressed = encode()
+            tmp_path = cache_path.with_name(cache_path.name + ".tmp")
+            tmp_path.write_bytes(compressed)
+            os.replace(tmp_path, cache_path)
+        if len(compressed) < len(data):
+            variants.append((suffix, compressed))
+    return variants
+
+
+def build_static_assets(files):
+    """Add content-hashed asset copies, rewrite references and precompress.
+
+    Works on the in-memory package (relative path -> bytes). Leaf assets
+    (scripts, fonts) are hashed first, then stylesheets after their url()
+    references are rewritten, so every hash covers the final bytes. HTML
+    pages keep their names and point at the hashed assets.
+    """
+    hashed = {}  # path relative to assets/ -> hashed relative path
+
+    def add_hashed(name):
+        path = Path(name)
+        digest = hashlib.sha256(files[name]).hexdigest()[:10]
+        hashed_name = path.with_name(f"{path.stem}.{digest}{path.suffix}").as_posix()
+        files[hashed_name] = files[name]
+        hashed[name[len("assets/"):]] = hashed_name[len("assets/"):]
+
+    assets = sorted(name for name in files if name.startswith("assets/"))
+    for name in assets:
+        if not name.endswith(".css"):
+            add_hashed(name)
+
+    css_url = re.compile(r"url\((['\"]?)([^'\")]+)\1\)")
+    for name in assets:
+        if not name.endswith(".css"):
+            continue
+        base = Path(name).parent.relative_to("assets")
+
+        def rewrite_url(match):
+            target = (base / match.group(2)).as_posix()
+            if target not in hashed:
+                return match.group(0)
+            new = Path(hashed[target]).relative_to(base).as_posix()
+            return f"url({match.group(1)}{new}{match.group(1)})"
+
+        files[name] = css_url.sub(rewrite_url, files[name].decode("utf-8")).encode("utf-8")
+        add_hashed(name)
+
+    asset_ref = re.compile(r"""(["'])assets/([^"']+)\1""")
+    for name in sorted(files):
+        if "/" in name or not name.endswith(".html"):
+            continue
+        html = asset_ref.sub(
+            lambda m: f"{m.group(1)}assets/{hashed.get(m.group(2), m.group(2))}{m.group(1)}",
+            files[name].decode("utf-8"),
+        )
+        files[name] = html.encode("utf-8")
+
+    # Compression releases the GIL, so threads run the encoders in parallel
+    BUILD_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    compressible = [
+        name for name in sorted(files)
+        if name.startswith("assets/") and Path(name).suffix in COMPRESSIBLE_SUFFIXES
+    ]
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as pool:
+        results = pool.map(lambda name: compress_variants(files[name]), compressible)
+        for name, variants in zip(compressible, results):
+            for suffix, compressed in variants:
+                files[name + suffix] = compressed
+
+    print(f"  ✓ Hashed {len(hashed)} assets and wrote precompressed variants")
+    if brotli is None:
+        print("  ⚠ brotli not installed: only .gz variants were created")
+
+
+def collect_package_files():
+    """Gather everything that goes into the package as path -> bytes."""
+    files = {}
     for file in REQUIRED_FILES:
         if Path(file).exists():
-            shutil.copy2(file, package_dir / file)
-            print(f"  ✓ Copied {file}")
+            files[file] = Path(file).read_bytes()
         else:
             print(f"  ⚠ Warning: {file} not found")
 
-    # Copy required directories
     for dir_name in REQUIRED_DIRS:
-        if Path(dir_name).exists():
-            shutil.copytree(dir_name, package_dir / dir_name, dirs_exist_ok=True)
-            print(f"  ✓ Copied {dir_name}/")
+        for path in sorted(Path(dir_name).rglob("*")):
+            if path.is_file():
+                files[path.as_posix()] = path.read_bytes()
 
-    # Create empty optional directories
-    for dir_name in OPTIONAL_DIRS:
-        (package_dir / dir_name).mkdir(exist_ok=True)
-        print(f"  ✓ Created {dir_name}/")
-
-    # Copy deployment files from deploy directory
+    # Deployment files generated into the deploy directory
     for file in [
         "requirements.txt",
         "config.py",
@@ -420,9 +610,8 @@ def create_build_package():
     ]:
         deploy_file = DEPLOY_DIR / file
         if deploy_file.exists():
-            shutil.copy2(deploy_file, package_dir / file)
+            files[file] = deploy_file.read_bytes()
 
-    # Create README for deployment
     readme_content = f"""# Rooster Data Prepare Tool - Production Deployment
 
 ## Quick Start
@@ -446,7 +635,8 @@ def create_build_package():
 3. Enable and start: `sudo systemctl enable --now rooster`
 
 ## Configuration
-- Edit `config.py` for server settings
+- Edit `config.py` for server settings (process manager, worker recycling)
+- Graceful worker restart: `kill -HUP $(cat rooster.pid)` or `systemctl reload rooster`
 - Default port: {PORT}
 - Access: http://localhost:{PORT}
 
@@ -455,20 +645,150 @@ def create_build_package():
 - Update server_name with your domain
 - Enable site and reload nginx
 """
+    files["README_DEPLOY.md"] = readme_content.encode("utf-8")
+    return files
+
+
+def zip_timestamp():
+    """Member timestamp: SOURCE_DATE_EPOCH when set, else the zip epoch."""
+    epoch = os.getenv("SOURCE_DATE_EPOCH")
+    if epoch:
+        return max(time.gmtime(int(epoch))[:6], (1980, 1, 1, 0, 0, 0))
+    return (1980, 1, 1, 0, 0, 0)
+
+
+def deflate_cached(data):
+    """Raw deflate stream of data (as ZIP_DEFLATED stores it), cached by content.
+
+    Streams live next to the .gz/.br variants in BUILD_CACHE_DIR, so a
+    build only deflates the members that changed since an earlier one.
+    """
+    cache_path = BUILD_CACHE_DIR / f"{hashlib.sha256(data).hexdigest()}.deflate"
+    if cache_path.exists():
+        return cache_path.read_bytes()
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    stream = compressor.compress(data) + compressor.flush()
+    tmp_path = cache_path.with_name(cache_path.name + ".tmp")
+    tmp_path.write_bytes(stream)
+    os.replace(tmp_path, cache_path)
+    return stream
+
+
+def write_package_zip(files, zip_path):
+    """Write the package as a zip with sorted, fixed-time members.
+
+    zipfile cannot add members that are already deflated, so the archive
+    records are written here directly, laid out as zipfile writes them
+    (no zip64: packages stay far below 4 GiB). Members are deflated in a
+    thread pool through deflate_cached; precompressed variants are stored
+    as they are, since deflating them again only costs time.
+    """
+    year, month, day, hour, minute, second = zip_timestamp()
+    dos_date = (year - 1980) << 9 | month << 5 | day
+    dos_time = hour << 11 | minute << 5 | second // 2
+    entries = [(f"{d}/", None) for d in OPTIONAL_DIRS] + sorted(files.items())
+    entries.sort(key=lambda entry: entry[0])
+    deflate = [
+        data for name, data in entries
+        if data is not None and Path(name).suffix not in (".gz", ".br")
+    ]
+    BUILD_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as pool:
+        deflated = iter(pool.map(deflate_cached, deflate))
+
+    tmp_path = zip_path.with_name(zip_path.name + ".tmp")
+    central = []
+    with open(tmp_path, "wb") as out:
+        for name, data in entries:
+            arcname = f"{PACKAGE_ROOT}/{name}"
+            try:
+                filename, flags = arcname.encode("ascii"), 0
+            except UnicodeEncodeError:
+                filename, flags = arcname.encode("utf-8"), 0x800
+            if data is None:
+                method, stream, attr = zipfile.ZIP_STORED, b"", (0o40755 << 16) | 0x10
+                data = b""
+            else:
+                executable = name in ("setup.sh", "run_production.py")
+                attr = (0o100755 if executable else 0o100644) << 16
+                if Path(name).suffix in (".gz", ".br"):
+                    method, stream = zipfile.ZIP_STORED, data
+                else:
+                    method, stream = zipfile.ZIP_DEFLATED, next(deflated)
+            crc = zlib.crc32(data)
+            fields = (flags, method, dos_time, dos_date, crc, len(stream), len(data))
+            central.append((out.tell(), filename, fields, attr))
+            out.write(struct.pack("<4s2B4HL2L2H", b"PK\x03\x04", 20, 0, *fields, len(filename), 0))
+            out.write(filename)
+            out.write(stream)
+        start = out.tell()
+        for offset, filename, fields, attr in central:
+            out.write(struct.pack(
+                "<4s4B4HL2L5H2L", b"PK\x01\x02", 20, 3, 20, 0, *fields,
+                len(filename), 0, 0, 0, 0, attr, offset,
+            ))
+            out.write(filename)
+        end = out.tell()
+        if end > 0xFFFFFFFF or len(central) > 0xFFFF:
+            raise RuntimeError("package too large for a zip without zip64")
+        out.write(struct.pack(
+            "<4s4H2LH", b"PK\x05\x06", 0, 0, len(central), len(central), end - start, start, 0
+        ))
+    os.replace(tmp_path, zip_path)
+
+
+def prune_old_packages(zip_path):
+    """Delete package zips left by earlier builds; only zip_path is current."""
+    for path in DEPLOY_DIR.glob(f"{PACKAGE_ROOT}_*.zip"):
+        if path != zip_path:
+            try:
+                path.unlink()
+            except OSError as e:
+                print(f"  ⚠ Could not delete old package {path}: {e}")
+            else:
+                print(f"  ✓ Removed old package {path.name}")
+
 
-    readme_path = package_dir / "README_DEPLOY.md"
-    readme_path.write_text(readme_content, encoding='utf-8')
+def create_build_package():
+    """Create a deployable package.
+
+    The package is assembled in memory and written directly to a zip named
+    after a hash of its contents; when nothing changed since the previous
+    build (see BUILD_MANIFEST), that zip is reused as is.
+    """
+    ensure_deploy_dir()
+    print("\n📦 Creating deployment package")
 
-    # Create ZIP archive in deploy directory
-    zip_path = DEPLOY_DIR / f"{package_name}.zip"
-    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
-        for file_path in package_dir.rglob("*"):
-            if file_path.is_file():
-                arcname = file_path.relative_to(package_dir.parent)
-                zipf.write(file_path, arcname)
+    files = collect_package_files()
+    build_static_assets(files)
 
-    # Clean up directory to avoid showing it alongside the ZIP
-    shutil.rmtree(package_dir)
+    manifest = {name: hashlib.sha256(data).hexdigest() for name, data in sorted(files.items())}
+    digest = hashlib.sha256(
+        json.dumps([manifest, OPTIONAL_DIRS, zip_timestamp()], sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    zip_path = DEPLOY_DIR / f"{PACKAGE_ROOT}_{digest[:10]}.zip"
+
+    previous = {}
+    if BUILD_MANIFEST.exists():
+        try:
+            previous = json.loads(BUILD_MANIFEST.read_text(encoding="utf-8")).get("files", {})
+        except (ValueError, OSError):
+            previous = {}
+    changed = sorted(n for n, h in manifest.items() if previous.get(n) != h)
+    removed = sorted(set(previous) - set(manifest))
+    print(f"  ✓ {len(manifest)} files, {len(changed)} changed, {len(removed)} removed since last build")
+
+    if zip_path.exists() and not changed and not removed:
+        prune_old_packages(zip_path)
+        print(f"\n✅ Deployment package unchanged: {zip_path}")
+        return zip_path
+
+    write_package_zip(files, zip_path)
+    prune_old_packages(zip_path)
+    BUILD_MANIFEST.write_text(
+        json.dumps({"package": zip_path.name, "files": manifest}, indent=2, sort_keys=True),
+        encoding="utf-8",
+    )
 
     print(f"\n✅ Deployment package created: {zip_path}")
     return zip_path
@@ -498,9 +818,15 @@ def main():
     print("\n" + "=" * 50)
     print(f"\n✅ All deployment files created in: {DEPLOY_DIR}/")
 
-    # Ask if user wants to create a package
-    response = input("\nCreate deployment package? (y/n): ").lower()
-    if response == "y":
+    # --build / --no-build skip the prompt (CI, scripts); without a
+    # terminal to ask, no package is built
+    if "--build" in sys.argv[1:]:
+        build = True
+    elif "--no-build" in sys.argv[1:] or not sys.stdin.isatty():
+        build = False
+    else:
+        build = input("\nCreate deployment package? (y/n): ").lower() == "y"
+    if build:
         package = create_build_package()
         print(f"\n🎉 Success! Deploy '{package}' to your server.")
     else:
@@ -1,16 +1,70 @@
 from __future__ import annotations
 
 import uvicorn
+import asyncio
+import cProfile
+import functools
+import gzip
+import hashlib
 import json
+import logging
+import math
+import mimetypes
+import os
+import pstats
+import random
+import re
+import signal
+import stat
+import string
+import sys
+import tempfile
+import threading
 import zipfile
 import time
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextvars import ContextVar
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
+from urllib.parse import parse_qs
+import anyio
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
+from fastapi.routing import APIRoute
 from fastapi.staticfiles import StaticFiles
+from starlette.background import BackgroundTask
+from starlette.datastructures import MutableHeaders
+from starlette.responses import Response
+
+try:  # Brotli is optional; gzip is used when it is not installed
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:  # Optional: needed for layouts, corpus stats and link suggestions
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+try:  # Optional: needed for the columnar (Parquet/Arrow) export
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = pq = None
+
+try:  # Unix only; worker recycling by memory is unavailable elsewhere
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+try:  # Unix only; elsewhere metric snapshots are folded without a file lock
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
 
 
 BASE_DIR = Path(__file__).resolve().parent
@@ -18,12 +72,907 @@ INDEX_FILE = BASE_DIR / "index.html"
 GRAPH_FILE = BASE_DIR / "graph.html"
 JSON_DATA_DIR = BASE_DIR / "json_data"
 GRAPH_DATA_DIR = JSON_DATA_DIR / "graph"
+# Topic chunks stored by immutable doc id; manifest["topicIndex"] maps name -> id
+TOPICS_DIR = JSON_DATA_DIR / "topics"
+DOC_ID_RE = re.compile(r"^doc_[A-Za-z0-9_-]+$")
 ASSETS_DIR = BASE_DIR / "assets"
 BACKUPS_DIR = BASE_DIR / "backups"
 BACKUP_METADATA_FILE = BACKUPS_DIR / "backup_metadata.json"
+METRICS_DIR = BASE_DIR / "metrics"
+PROFILES_DIR = BASE_DIR / "profiles"
+LAYOUTS_DIR = BASE_DIR / "cache" / "layouts"
+
+
+# Metrics are kept per process and flushed to METRICS_DIR/<pid>.json so that
+# /metrics can aggregate every uvicorn worker, whichever one gets scraped.
+# Snapshots of exited workers are folded into METRICS_DIR/retired.json.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9)
+METRICS_FLUSH_INTERVAL = 5.0
+
+METRIC_DEFS: Dict[str, Tuple[str, str, Tuple[float, ...]]] = {
+    "rooster_http_request_duration_seconds": (
+        "histogram", "Request latency per route", LATENCY_BUCKETS),
+    "rooster_http_request_bytes_total": (
+        "counter", "Request payload bytes received per route", ()),
+    "rooster_http_response_bytes_total": (
+        "counter", "Response payload bytes sent per route", ()),
+    "rooster_json_seconds": (
+        "histogram", "Time spent parsing or serializing JSON files", LATENCY_BUCKETS),
+    "rooster_storage_files_read_total": (
+        "counter", "JSON files read from storage per route", ()),
+    "rooster_storage_files_written_total": (
+        "counter", "JSON files written to storage per route", ()),
+    "rooster_storage_bytes_written_total": (
+        "counter", "Bytes written to storage per route", ()),
+    "rooster_backup_duration_seconds": (
+        "histogram", "Time taken to build a backup archive", LATENCY_BUCKETS),
+    "rooster_backup_size_bytes": (
+        "histogram", "Size of created backup archives", SIZE_BUCKETS),
+    "rooster_cache_requests_total": (
+        "counter", "Cache lookups by cache name and result (hit/miss)", ()),
+    "rooster_coalesce_flights_total": (
+        "counter", "Read computations started per coalesced endpoint", ()),
+    "rooster_coalesced_requests_total": (
+        "counter", "Requests answered by joining another request's in-flight read", ()),
+}
+
+_metrics_lock = threading.Lock()
+_counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+_histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], List[float]] = {}
+_metrics_last_flush = 0.0
+
+# ASGI scope of the request being handled; storage metrics are labelled with
+# its route template (routing fills scope["route"] before the endpoint runs)
+_current_scope: ContextVar[Optional[Dict[str, Any]]] = ContextVar("current_scope", default=None)
+
+
+def current_route() -> str:
+    """Route template of the current request, e.g. /graph_layout/{doc_id}."""
+    scope = _current_scope.get()
+    return getattr(scope.get("route"), "path", "-") if scope is not None else "-"
+
+
+def inc_counter(name: str, value: float = 1.0, **labels: str) -> None:
+    key = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        _counters[key] = _counters.get(key, 0.0) + value
+
+
+def observe(name: str, value: float, **labels: str) -> None:
+    """Record a histogram sample; layout is [bucket counts..., +Inf, sum]."""
+    buckets = METRIC_DEFS[name][2]
+    key = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [0.0] * (len(buckets) + 2)
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                hist[i] += 1
+        hist[-2] += 1
+        hist[-1] += value
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    inc_counter("rooster_cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+
+def flush_metrics(force: bool = False) -> None:
+    """Write this worker's metrics snapshot to METRICS_DIR (throttled)."""
+    global _metrics_last_flush
+    now = time.monotonic()
+    if not force and now - _metrics_last_flush < METRICS_FLUSH_INTERVAL:
+        return
+    _metrics_last_flush = now
+    with _metrics_lock:
+        snapshot = {
+            "counters": [[n, list(l), v] for (n, l), v in _counters.items()],
+            "histograms": [[n, list(l), h] for (n, l), h in _histograms.items()],
+        }
+    try:
+        METRICS_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_path = METRICS_DIR / f".{os.getpid()}.tmp"
+        tmp_path.write_text(json.dumps(snapshot), encoding="utf-8")
+        os.replace(tmp_path, METRICS_DIR / f"{os.getpid()}.json")
+    except OSError as e:
+        print(f"Error writing metrics snapshot: {e}")
+
+
+def merge_snapshot(counters, histograms, snapshot: Dict[str, Any]) -> None:
+    """Add one metrics snapshot into counters/histograms keyed like _counters."""
+    for name, labels, value in snapshot.get("counters", []):
+        key = (name, tuple(tuple(pair) for pair in labels))
+        counters[key] = counters.get(key, 0.0) + value
+    for name, labels, hist in snapshot.get("histograms", []):
+        key = (name, tuple(tuple(pair) for pair in labels))
+        merged = histograms.get(key)
+        if merged is None:
+            histograms[key] = list(hist)
+        elif len(merged) == len(hist):
+            histograms[key] = [a + b for a, b in zip(merged, hist)]
+
+
+@contextmanager
+def metrics_dir_lock():
+    """Serialize folding and reading snapshots across worker processes."""
+    METRICS_DIR.mkdir(parents=True, exist_ok=True)
+    with open(METRICS_DIR / ".lock", "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def pid_alive(pid: int) -> bool:
+    if os.name != "posix":  # os.kill(pid, 0) terminates the process on Windows
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def fold_snapshots(paths: List[Path]) -> None:
+    """Add worker snapshots to retired.json and delete them (lock held)."""
+    retired_path = METRICS_DIR / "retired.json"
+    counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+    histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], List[float]] = {}
+    for path in [retired_path, *paths]:
+        try:
+            merge_snapshot(counters, histograms, json.loads(path.read_text(encoding="utf-8")))
+        except (OSError, ValueError):
+            continue
+    retired = {
+        "counters": [[n, list(l), v] for (n, l), v in counters.items()],
+        "histograms": [[n, list(l), h] for (n, l), h in histograms.items()],
+    }
+    try:
+        tmp_path = METRICS_DIR / f".retired.{os.getpid()}.tmp"
+        tmp_path.write_text(json.dumps(retired), encoding="utf-8")
+        os.replace(tmp_path, retired_path)
+        for path in paths:
+            path.unlink(missing_ok=True)
+    except OSError as e:
+        print(f"Error folding metrics snapshots: {e}")
+
+
+def retire_metrics() -> None:
+    """Flush this worker's metrics one last time and fold them into retired.json."""
+    flush_metrics(force=True)
+    path = METRICS_DIR / f"{os.getpid()}.json"
+    if path.exists():
+        with metrics_dir_lock():
+            fold_snapshots([path])
+
+
+def render_metrics() -> str:
+    """Merge all worker snapshots and render them in Prometheus text format.
+
+    Snapshots left by workers that died without retiring are folded first.
+    """
+    flush_metrics(force=True)
+    counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+    histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], List[float]] = {}
+    with metrics_dir_lock():
+        dead = [
+            path for path in METRICS_DIR.glob("*.json")
+            if path.stem.isdigit() and int(path.stem) != os.getpid()
+            and not pid_alive(int(path.stem))
+        ]
+        if dead:
+            fold_snapshots(dead)
+        for path in METRICS_DIR.glob("*.json"):
+            try:
+                snapshot = json.loads(path.read_text(encoding="utf-8"))
+            except Exception:
+                continue
+            merge_snapshot(counters, histograms, snapshot)
+
+    def fmt_labels(labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (
+            k + '="' + str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+            for k, v in pairs
+        )
+        return "{" + ",".join(escaped) + "}"
+
+    def fmt_value(value: float) -> str:
+        # Full precision: large byte counters must not lose increments
+        return repr(float(value))
+
+    lines: List[str] = []
+    for name, (kind, help_text, buckets) in METRIC_DEFS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == "counter":
+            for (n, labels), value in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{name}{fmt_labels(labels)} {fmt_value(value)}")
+            continue
+        for (n, labels), hist in sorted(histograms.items()):
+            if n != name:
+                continue
+            # Stored bucket counts are already cumulative (value <= bound)
+            for bound, count in zip(buckets, hist):
+                le = (("le", fmt_value(bound)),)
+                lines.append(f"{name}_bucket{fmt_labels(labels, le)} {fmt_value(count)}")
+            inf = (("le", "+Inf"),)
+            lines.append(f"{name}_bucket{fmt_labels(labels, inf)} {fmt_value(hist[-2])}")
+            lines.append(f"{name}_sum{fmt_labels(labels)} {fmt_value(hist[-1])}")
+            lines.append(f"{name}_count{fmt_labels(labels)} {fmt_value(hist[-2])}")
+    return "\n".join(lines) + "\n"
+
+
+# Stage timing: span() records nested durations for the current request,
+# reported in the Server-Timing header and as JSON log lines when
+# ROOSTER_TIMING=1. With timing off span() returns a shared no-op context.
+TIMING_ENABLED = os.getenv("ROOSTER_TIMING", "0") == "1"
+
+timing_logger = logging.getLogger("rooster.timing")
+if TIMING_ENABLED and not timing_logger.handlers:
+    _timing_handler = logging.StreamHandler()
+    _timing_handler.setFormatter(logging.Formatter("%(message)s"))
+    timing_logger.addHandler(_timing_handler)
+    timing_logger.setLevel(logging.INFO)
+    timing_logger.propagate = False
+
+
+class TimingRecorder:
+    """Accumulates span durations keyed by their dotted nesting path."""
+
+    __slots__ = ("stack", "totals")
+
+    def __init__(self) -> None:
+        self.stack: List[str] = []
+        self.totals: Dict[str, List[float]] = {}  # path -> [seconds, count]
+
+
+class Span:
+    __slots__ = ("recorder", "name", "started")
+
+    def __init__(self, recorder: TimingRecorder, name: str) -> None:
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self) -> "Span":
+        self.recorder.stack.append(self.name)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        elapsed = time.perf_counter() - self.started
+        path = ".".join(self.recorder.stack)
+        self.recorder.stack.pop()
+        total = self.recorder.totals.get(path)
+        if total is None:
+            self.recorder.totals[path] = [elapsed, 1]
+        else:
+            total[0] += elapsed
+            total[1] += 1
+
+
+_timing_recorder: ContextVar[Optional[TimingRecorder]] = ContextVar(
+    "timing_recorder", default=None
+)
+_NO_SPAN = nullcontext()
+
+
+def span(name: str):
+    """Time a stage of the current request: ``with span("manifest"): ...``."""
+    recorder = _timing_recorder.get()
+    if recorder is None:
+        return _NO_SPAN
+    return Span(recorder, name)
+
+
+class TimingMiddleware:
+    """ASGI middleware exposing span() timings as Server-Timing and JSON logs."""
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if not TIMING_ENABLED or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        recorder = TimingRecorder()
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                entries = [
+                    f'{path};dur={seconds * 1000:.2f};desc="x{count}"'
+                    for path, (seconds, count) in recorder.totals.items()
+                ]
+                entries.append(f"total;dur={(time.perf_counter() - started) * 1000:.2f}")
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", ", ".join(entries).encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        token = _timing_recorder.set(recorder)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _timing_recorder.reset(token)
+            timing_logger.info(json.dumps({
+                "event": "request_timing",
+                "method": scope.get("method"),
+                "path": scope.get("path"),
+                "status": status,
+                "total_ms": round((time.perf_counter() - started) * 1000, 3),
+                "spans": {
+                    path: {"ms": round(seconds * 1000, 3), "count": count}
+                    for path, (seconds, count) in recorder.totals.items()
+                },
+            }, ensure_ascii=False))
+
+
+# Parsed JSON files keyed by path, validated against (mtime_ns, size)
+_json_cache: Dict[Path, Tuple[int, int, Any]] = {}
+
+
+def load_json(path: Path, cached: bool = False) -> Any:
+    """Read and parse a JSON file, recording storage and parse metrics.
+
+    With cached=True the parsed object is reused while the file is unchanged;
+    callers must treat such results as read-only.
+    """
+    if cached:
+        stat = path.stat()
+        entry = _json_cache.get(path)
+        hit = entry is not None and entry[:2] == (stat.st_mtime_ns, stat.st_size)
+        record_cache("json_files", hit)
+        if hit:
+            return entry[2]
+    with span("io"):
+        raw = path.read_bytes()
+    started = time.perf_counter()
+    with span("parse"):
+        data = json.loads(raw)
+    observe("rooster_json_seconds", time.perf_counter() - started, op="parse")
+    inc_counter("rooster_storage_files_read_total", route=current_route())
+    if cached:
+        _json_cache[path] = (stat.st_mtime_ns, stat.st_size, data)
+    return data
+
+
+def dump_json(data: Any, path: Path) -> int:
+    """Serialize data to a JSON file the same way the frontend expects it.
+
+    Returns the number of bytes written.
+    """
+    started = time.perf_counter()
+    with span("serialize"):
+        raw = json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+    observe("rooster_json_seconds", time.perf_counter() - started, op="serialize")
+    with span("io"):
+        path.write_bytes(raw)
+    route = current_route()
+    inc_counter("rooster_storage_files_written_total", route=route)
+    inc_counter("rooster_storage_bytes_written_total", len(raw), route=route)
+    return len(raw)
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing each request and counting payload bytes.
+
+    Works on raw ASGI messages so streamed responses are measured without
+    buffering them.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        received = 0
+        sent = 0
+        status = 500
+
+        async def counting_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal sent, status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        path = scope.get("path", "")
+        token = _current_scope.set(scope)
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            _current_scope.reset(token)
+            route = getattr(scope.get("route"), "path", None)
+            if route is None:
+                route = "/assets" if path.startswith("/assets/") else "<unmatched>"
+            observe(
+                "rooster_http_request_duration_seconds",
+                time.perf_counter() - started,
+                route=route, method=scope.get("method", ""), status=str(status),
+            )
+            inc_counter("rooster_http_request_bytes_total", received, route=route)
+            inc_counter("rooster_http_response_bytes_total", sent, route=route)
+            flush_metrics()
+
+
+# Opt-in request profiling: ROOSTER_PROFILING=1 allows the X-Profile header or
+# ?profile=1 query flag, ROOSTER_PROFILE_SAMPLE_RATE profiles a random share.
+PROFILING_ENABLED = os.getenv("ROOSTER_PROFILING", "0") == "1"
+PROFILE_SAMPLE_RATE = float(os.getenv("ROOSTER_PROFILE_SAMPLE_RATE", "0"))
+PROFILES_MAX_FILES = 50
+PROFILES_MAX_BYTES = 50 * 1024 * 1024
+# <created ms>_<pid>_<path slug>_<duration>ms.prof, as save_profile writes them
+PROFILE_NAME_RE = re.compile(r"^(\d+)_(\d+)_([A-Za-z0-9-]+)_(\d+)ms\.prof$")
+
+# Profilers collected for the current request (one per thread that ran code)
+_request_profilers: ContextVar[Optional[List[cProfile.Profile]]] = ContextVar(
+    "request_profilers", default=None
+)
+# Only one request at a time may profile the event loop thread itself
+_loop_profiler_lock = threading.Lock()
+
+
+def wants_profile(scope) -> bool:
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return True
+    if not PROFILING_ENABLED:
+        return False
+    flag = dict(scope.get("headers") or []).get(b"x-profile", b"").decode("latin-1")
+    if not flag:
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        flag = query.get("profile", [""])[0]
+    return flag.lower() in ("1", "true", "yes")
+
+
+def save_profile(name: str, profilers: List[cProfile.Profile]) -> None:
+    """Merge per-thread profilers into one pstats file and enforce the size cap."""
+    stats: Optional[pstats.Stats] = None
+    for profiler in profilers:
+        try:
+            if stats is None:
+                stats = pstats.Stats(profiler)
+            else:
+                stats.add(profiler)
+        except TypeError:
+            continue  # profiler recorded nothing
+    if stats is None:
+        return
+
+    PROFILES_DIR.mkdir(parents=True, exist_ok=True)
+    stats.dump_stats(str(PROFILES_DIR / name))
+
+    # Evict oldest profiles beyond the file count or total size limits
+    files = sorted(PROFILES_DIR.glob("*.prof"), key=lambda p: p.stat().st_mtime, reverse=True)
+    total = 0
+    for index, path in enumerate(files):
+        total += path.stat().st_size
+        if index >= PROFILES_MAX_FILES or total > PROFILES_MAX_BYTES:
+            try:
+                path.unlink()
+            except OSError as e:
+                print(f"Error deleting old profile {path}: {e}")
+
+
+def profiled_endpoint(endpoint):
+    """Wrap a sync endpoint so it runs under a profiler when one is requested.
+
+    Sync endpoints execute in the threadpool, out of reach of the profiler
+    that ProfilingMiddleware enables on the event loop thread.
+    """
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        profilers = _request_profilers.get()
+        if profilers is None:
+            return endpoint(*args, **kwargs)
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(endpoint, *args, **kwargs)
+        finally:
+            profilers.append(profiler)
+
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+    def __init__(self, path: str, endpoint, **kwargs) -> None:
+        if not asyncio.iscoroutinefunction(endpoint):
+            endpoint = profiled_endpoint(endpoint)
+        super().__init__(path, endpoint, **kwargs)
 
 
-app = FastAPI(title="JsonMaker Backend", version="1.0.0")
+class ProfilingMiddleware:
+    """ASGI middleware capturing a cProfile of selected requests.
+
+    Profiles are written to PROFILES_DIR as pstats files (snakeviz,
+    flameprof, py-spy compatible) and announced via the X-Profile-Id header.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or not wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        # ASCII only: the id goes into a latin-1 response header
+        slug = "".join(
+            c if c.isascii() and c.isalnum() else "-" for c in scope.get("path", "")
+        ).strip("-")
+        started = time.perf_counter()
+        profile_id = f"{int(time.time() * 1000)}_{os.getpid()}_{slug or 'root'}"
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-profile-id", profile_id.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        profilers: List[cProfile.Profile] = []
+        token = _request_profilers.set(profilers)
+        loop_profiler = None
+        if _loop_profiler_lock.acquire(blocking=False):
+            loop_profiler = cProfile.Profile()
+            loop_profiler.enable()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            if loop_profiler is not None:
+                loop_profiler.disable()
+                _loop_profiler_lock.release()
+                profilers.append(loop_profiler)
+            _request_profilers.reset(token)
+            elapsed_ms = int((time.perf_counter() - started) * 1000)
+            save_profile(f"{profile_id}_{elapsed_ms}ms.prof", profilers)
+
+
+# Response compression for API payloads. Brotli is optional; gzip is always
+# available. Streamed responses (large static files) pass through untouched.
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_THREAD_SIZE = 64 * 1024  # compress off the event loop above this
+COMPRESSIBLE_TYPES = (
+    "text/", "application/json", "application/javascript", "image/svg+xml", "font/ttf",
+)
+# Content-hashed asset names produced by deploy.py, e.g. graph.3f2a9c1b7d.js
+HASHED_ASSET_RE = re.compile(r"\.[0-9a-f]{10}\.[A-Za-z0-9]+$")
+
+
+def accepted_encoding(scope) -> Optional[str]:
+    header = dict(scope.get("headers") or []).get(b"accept-encoding", b"").decode("latin-1")
+    offered = {part.split(";")[0].strip().lower() for part in header.split(",")}
+    if brotli is not None and "br" in offered:
+        return "br"
+    if "gzip" in offered:
+        return "gzip"
+    return None
+
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=4)
+    return gzip.compress(body, compresslevel=6, mtime=0)
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing single-message responses with br or gzip."""
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send) -> None:
+        encoding = accepted_encoding(scope) if scope["type"] == "http" else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+
+        async def compressing_send(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if start_message is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            start, start_message = start_message, None
+            headers = MutableHeaders(raw=list(start.get("headers", [])))
+            body = message.get("body", b"")
+            if (
+                message.get("more_body", False)
+                or len(body) < self.minimum_size
+                or "content-encoding" in headers
+                or not headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+            ):
+                await send(start)
+                await send(message)
+                return
+
+            if len(body) > COMPRESSION_THREAD_SIZE:
+                body = await anyio.to_thread.run_sync(compress_body, body, encoding)
+            else:
+                body = compress_body(body, encoding)
+            headers["content-encoding"] = encoding
+            headers["content-length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            await send({**start, "headers": headers.raw})
+            await send({**message, "body": body})
+
+        await self.app(scope, receive, compressing_send)
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles serving .br/.gz siblings written by deploy.py when present.
+
+    Content-hashed file names are served as immutable for a year; everything
+    else must be revalidated (ETag/Last-Modified) on each use.
+    """
+
+    async def get_response(self, path: str, scope) -> Response:
+        encoding = accepted_encoding(scope) if scope["method"] in ("GET", "HEAD") else None
+        response = None
+        if encoding is not None:
+            suffix = ".br" if encoding == "br" else ".gz"
+            full_path, stat_result = await anyio.to_thread.run_sync(
+                self.lookup_path, path + suffix
+            )
+            if stat_result is not None and stat.S_ISREG(stat_result.st_mode):
+                response = self.file_response(full_path, stat_result, scope)
+                media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+                if media_type.startswith("text/"):
+                    media_type += "; charset=utf-8"
+                response.headers["content-type"] = media_type
+                response.headers["content-encoding"] = encoding
+        if response is None:
+            response = await super().get_response(path, scope)
+        response.headers.add_vary_header("Accept-Encoding")
+        if HASHED_ASSET_RE.search(path):
+            response.headers["cache-control"] = "public, max-age=31536000, immutable"
+        else:
+            response.headers["cache-control"] = "no-cache"
+        return response
+
+
+# Payload validation. Schemas are compiled once into flat tuples of checks;
+# validators append every problem to a shared error list so a request gets
+# all of its errors in one 422 response. Extra fields are always allowed.
+MAX_REPORTED_ERRORS = 1000
+
+INT = frozenset({int})  # exact type checks, so bools are not ints
+NUMBER = frozenset({int, float})
+STRING = frozenset({str})
+BOOLEAN = frozenset({bool})
+
+# field -> (accepted types, required)
+CHUNK_SCHEMA = {
+    "id": (STRING, True),
+    "order": (NUMBER, True),  # script.js inserts between chunks at fractional orders
+    "input": (STRING, False),
+    "output": (STRING, False),
+    "depth": (INT, False),
+}
+BOOK_META_SCHEMA = {
+    "id": (STRING, True),
+    "name": (STRING, False),
+    "created": (NUMBER, False),
+}
+CONNECTION_SCHEMA = {
+    "id": (STRING, True),
+    "source": (STRING, True),
+    "target": (STRING, True),
+    "type": (STRING, False),
+    "createdAt": (NUMBER, False),
+    "userDefined": (BOOLEAN, False),
+}
+
+
+def compile_schema(schema: Dict[str, Tuple[frozenset, bool]]):
+    """Turn a field schema into a validator(obj, path, key, errors) -> bool.
+
+    The item path ``path[key]`` is only formatted when an error is reported.
+    """
+    type_names = {int: "integer", float: "number", str: "string", bool: "boolean"}
+
+    def describe(types: frozenset) -> str:
+        if types >= NUMBER:  # an integer is a number too
+            types = (types - NUMBER) | {float}
+        return " or ".join(sorted(type_names[t] for t in types))
+
+    checks = tuple(
+        (field, types, required, describe(types))
+        for field, (types, required) in schema.items()
+    )
+
+    def validate(obj: Any, path: str, key: Any, errors: List[Dict[str, str]]) -> bool:
+        if type(obj) is not dict:
+            errors.append({"path": f"{path}[{key!r}]", "message": "must be an object"})
+            return False
+        valid = True
+        for field, types, required, expected in checks:
+            value = obj.get(field)
+            if value is None:
+                if not required:
+                    continue
+                message = "is required"
+            elif type(value) not in types:
+                message = f"must be {expected}"
+            elif required and value == "":
+                message = "must not be empty"
+            else:
+                continue
+            errors.append({"path": f"{path}[{key!r}].{field}", "message": message})
+            valid = False
+        return valid
+
+    return validate
+
+
+validate_chunk = compile_schema(CHUNK_SCHEMA)
+validate_book_meta = compile_schema(BOOK_META_SCHEMA)
+validate_connection = compile_schema(CONNECTION_SCHEMA)
+
+
+def validate_chunks(chunks: Any, path: str, errors: List[Dict[str, str]]) -> set:
+    """Validate a topic's chunk list and return the set of its chunk ids."""
+    ids: set = set()
+    if type(chunks) is not list:
+        errors.append({"path": path, "message": "must be an array"})
+        return ids
+    for index, chunk in enumerate(chunks):
+        validate_chunk(chunk, path, index, errors)
+        chunk_id = chunk.get("id") if type(chunk) is dict else None
+        if type(chunk_id) is str:
+            if chunk_id in ids:
+                errors.append({
+                    "path": f"{path}[{index}].id",
+                    "message": f"duplicate id {chunk_id!r}",
+                })
+            ids.add(chunk_id)
+    return ids
+
+
+def validate_books_meta(books_meta: Any, path: str, errors: List[Dict[str, str]]) -> None:
+    if type(books_meta) is not dict:
+        errors.append({"path": path, "message": "must be an object"})
+        return
+    for name, meta in books_meta.items():
+        validate_book_meta(meta, path, name, errors)
+
+
+def validate_connections(
+    connections: Any,
+    path: str,
+    errors: List[Dict[str, str]],
+    chunk_ids: Optional[set] = None,
+) -> None:
+    """Validate an edge list; with chunk_ids, endpoints must reference them."""
+    if type(connections) is not list:
+        errors.append({"path": path, "message": "must be an array"})
+        return
+    for index, connection in enumerate(connections):
+        if not validate_connection(connection, path, index, errors) or chunk_ids is None:
+            continue
+        for end in ("source", "target"):
+            if connection[end] not in chunk_ids:
+                errors.append({
+                    "path": f"{path}[{index}].{end}",
+                    "message": f"unknown chunk id {connection[end]!r}",
+                })
+
+
+def raise_for_errors(errors: List[Dict[str, str]]) -> None:
+    if errors:
+        raise HTTPException(
+            status_code=422,
+            detail={
+                "message": "داده‌های ارسالی نامعتبر است",
+                "errorCount": len(errors),
+                "errors": errors[:MAX_REPORTED_ERRORS],
+            },
+        )
+
+
+# Set by run_production.py under gunicorn, which replaces a worker that exits
+MAX_WORKER_MEMORY_MB = int(os.getenv("ROOSTER_MAX_WORKER_MEMORY_MB", "0"))
+
+
+class WorkerRecycleMiddleware:
+    """Gracefully stop this worker once its peak RSS exceeds the limit.
+
+    The process manager (gunicorn) starts a fresh worker in its place, so
+    memory growth is capped without dropping in-flight requests.
+    """
+
+    def __init__(self, app, max_memory_mb: int = MAX_WORKER_MEMORY_MB) -> None:
+        self.app = app
+        self.max_memory_mb = max_memory_mb
+        self.recycling = False
+
+    async def __call__(self, scope, receive, send) -> None:
+        await self.app(scope, receive, send)
+        if self.recycling or resource is None or scope["type"] != "http":
+            return
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in KiB on Linux and bytes on macOS
+        peak_mb = peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+        if peak_mb > self.max_memory_mb:
+            self.recycling = True
+            print(f"Worker {os.getpid()} reached {peak_mb:.0f} MB, recycling")
+            flush_metrics(force=True)
+            os.kill(os.getpid(), signal.SIGTERM)
+
+
+# Progress of the background dataset warm-up reported by /ready
+_warmup_status: Dict[str, Any] = {
+    "state": "pending",
+    "filesTotal": 0,
+    "filesLoaded": 0,
+    "startedAt": None,
+    "finishedAt": None,
+    "error": None,
+}
+
+
+def warm_up_dataset() -> None:
+    """Parse every topic, the manifest and graph_data into the JSON cache."""
+    status = _warmup_status
+    status.update(state="warming", filesLoaded=0, startedAt=time.time(), error=None)
+    try:
+        paths = sorted(JSON_DATA_DIR.glob("*.json")) if JSON_DATA_DIR.exists() else []
+        paths += sorted(TOPICS_DIR.glob("*.json")) if TOPICS_DIR.exists() else []
+        graph_data_path = GRAPH_DATA_DIR / "graph_data.json"
+        if graph_data_path.exists():
+            paths.append(graph_data_path)
+        status["filesTotal"] = len(paths)
+        for path in paths:
+            try:
+                load_json(path, cached=True)
+            except Exception as e:
+                print(f"Error warming up {path}: {e}")
+            status["filesLoaded"] += 1
+        refresh_overview()
+        status["state"] = "ready"
+    except Exception as e:
+        status.update(state="failed", error=str(e))
+    status["finishedAt"] = time.time()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Serve requests right away; /ready turns 200 once the cache is warm
+    threading.Thread(target=warm_up_dataset, name="dataset-warmup", daemon=True).start()
+    yield
+    # Keep the increments since the last throttled flush past this worker
+    retire_metrics()
+
+
+app = FastAPI(title="JsonMaker Backend", version="1.0.0", lifespan=lifespan)
+app.router.route_class = ProfiledRoute
 
 # CORS for local dev and file:// opened pages; keep permissive for dev
 app.add_middleware(
@@ -33,24 +982,225 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(TimingMiddleware)
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(MetricsMiddleware)
+if MAX_WORKER_MEMORY_MB > 0:
+    app.add_middleware(WorkerRecycleMiddleware)
 
 # Mount static files for assets
 if ASSETS_DIR.exists():
-    app.mount("/assets", StaticFiles(directory=str(ASSETS_DIR)), name="assets")
+    app.mount("/assets", PrecompressedStaticFiles(directory=str(ASSETS_DIR)), name="assets")
 
 
 @app.get("/")
 def serve_index() -> FileResponse:
     if not INDEX_FILE.exists():
         raise HTTPException(status_code=404, detail="index.html not found")
-    return FileResponse(str(INDEX_FILE), media_type="text/html; charset=utf-8")
+    return FileResponse(
+        str(INDEX_FILE),
+        media_type="text/html; charset=utf-8",
+        headers={"Cache-Control": "no-cache"},
+    )
 
 
 @app.get("/graph")
 def serve_graph() -> FileResponse:
     if not GRAPH_FILE.exists():
         raise HTTPException(status_code=404, detail="graph.html not found")
-    return FileResponse(str(GRAPH_FILE), media_type="text/html; charset=utf-8")
+    return FileResponse(
+        str(GRAPH_FILE),
+        media_type="text/html; charset=utf-8",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@app.get("/ready")
+def readiness() -> JSONResponse:
+    """Readiness probe: 503 until the dataset warm-up has finished."""
+    status = dict(_warmup_status)
+    total = status["filesTotal"]
+    status["progress"] = status["filesLoaded"] / total if total else (
+        1.0 if status["state"] == "ready" else 0.0
+    )
+    return JSONResponse(status, status_code=200 if status["state"] == "ready" else 503)
+
+
+@app.get("/metrics")
+def serve_metrics() -> PlainTextResponse:
+    """Prometheus scrape endpoint, aggregated across all workers."""
+    return PlainTextResponse(
+        render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.get("/profiles")
+def list_profiles() -> Dict[str, Any]:
+    """List captured request profiles, newest first.
+
+    Files not named like save_profile names them (copied in by hand, or
+    half-written) are skipped rather than failing the whole listing.
+    """
+    profiles = []
+    if PROFILES_DIR.exists():
+        for path in PROFILES_DIR.glob("*.prof"):
+            match = PROFILE_NAME_RE.match(path.name)
+            if match is None:
+                continue
+            try:
+                size = path.stat().st_size
+            except OSError:  # pruned by another worker meanwhile
+                continue
+            created, pid, slug, duration = match.groups()
+            profiles.append({
+                "name": path.name,
+                "created": int(created),
+                "pid": int(pid),
+                "path": slug,
+                "duration_ms": int(duration),
+                "size_bytes": size,
+            })
+    profiles.sort(key=lambda p: p["created"], reverse=True)
+    return {"profiles": profiles, "enabled": PROFILING_ENABLED, "sampleRate": PROFILE_SAMPLE_RATE}
+
+
+@app.get("/profiles/{name}")
+def download_profile(name: str) -> FileResponse:
+    """Download a pstats profile (open with snakeviz or flameprof)."""
+    path = PROFILES_DIR / name
+    if Path(name).name != name or path.suffix != ".prof" or not path.is_file():
+        raise HTTPException(status_code=404, detail="profile not found")
+    return FileResponse(str(path), media_type="application/octet-stream", filename=name)
+
+
+def topic_path(doc_id: str) -> Path:
+    return TOPICS_DIR / f"{doc_id}.json"
+
+
+def new_doc_id() -> str:
+    """Random id in the same format as randomDocId() in script.js."""
+    return "doc_" + "".join(random.choices(string.ascii_letters + string.digits, k=8))
+
+
+def assign_topic_ids(
+    topics: List[str], books_meta: Dict[str, Any], previous_index: Dict[str, str]
+) -> Dict[str, str]:
+    """Map every topic name to a unique doc id used as its storage key.
+
+    Uses booksMeta[topic].id when it is a valid doc id, else the id the name
+    had before. Missing or colliding ids get a fresh id, which is written
+    back into books_meta so the browser adopts it on the next restore.
+    """
+    index: Dict[str, str] = {}
+    used: set = set()
+    for topic in topics:
+        meta = books_meta.get(topic)
+        doc_id = meta.get("id") if isinstance(meta, dict) else None
+        if not isinstance(doc_id, str) or not DOC_ID_RE.match(doc_id):
+            doc_id = previous_index.get(topic)
+        if not doc_id or doc_id in used:
+            doc_id = new_doc_id()
+            while doc_id in used:
+                doc_id = new_doc_id()
+        if not isinstance(meta, dict) or meta.get("id") != doc_id:
+            books_meta[topic] = {
+                "name": topic,
+                "created": int(time.time() * 1000),
+                **(meta if isinstance(meta, dict) else {}),
+                "id": doc_id,
+            }
+        used.add(doc_id)
+        index[topic] = doc_id
+    return index
+
+
+def write_topic(doc_id: str, entries: Any) -> bool:
+    """Write a topic's chunks unless the stored file already holds them."""
+    path = topic_path(doc_id)
+    if path.exists():
+        try:
+            if load_json(path, cached=True) == entries:
+                return False
+        except Exception:
+            pass
+    dump_json(entries, path)
+    return True
+
+
+def migrate_legacy_topics(manifest: Dict[str, Any]) -> None:
+    """Move name-keyed topic files (json_data/<name>.json) to topics/<doc_id>.json.
+
+    Topic names are recovered the way restore used to do it and ids are
+    taken from the manifest's booksMeta where possible.
+    """
+    books_meta = manifest.setdefault("booksMeta", {})
+    legacy = {}
+    for path in sorted(JSON_DATA_DIR.glob("*.json")):
+        if path.name not in ("manifest.json", "graph_data.json"):
+            legacy[path.stem.replace("_", " ")] = path
+    index = assign_topic_ids(list(legacy), books_meta, {})
+    TOPICS_DIR.mkdir(parents=True, exist_ok=True)
+    for topic, path in legacy.items():
+        os.replace(path, topic_path(index[topic]))
+    manifest["topicIndex"] = index
+    manifest["topics"] = list(index)
+    manifest["files"] = [f"topics/{doc_id}.json" for doc_id in index.values()]
+
+
+# Single-flight reads: concurrent identical read requests for the same
+# dataset revision (see dataset_revision) share one computation and its
+# serialized body. Nothing is kept once the leader finishes, so this is
+# not a cache; a write simply makes later requests start a new flight.
+class Flight:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+_flights: Dict[Tuple[str, str], Flight] = {}
+_flights_lock = threading.Lock()
+
+
+def single_flight(name: str, key: str, compute) -> Any:
+    """Run compute() once per in-flight (name, key); joiners share its result."""
+    with _flights_lock:
+        flight = _flights.get((name, key))
+        leader = flight is None
+        if leader:
+            flight = _flights[(name, key)] = Flight()
+    if not leader:
+        inc_counter("rooster_coalesced_requests_total", endpoint=name)
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    inc_counter("rooster_coalesce_flights_total", endpoint=name)
+    try:
+        flight.result = compute()
+    except BaseException as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[(name, key)]
+        flight.done.set()
+    return flight.result
+
+
+def coalesced_json(name: str, compute) -> Response:
+    """Run compute() once per in-flight (name, revision) and share its JSON."""
+    def serialize() -> bytes:
+        data = compute()
+        with span("serialize"):
+            return json.dumps(
+                data, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+            ).encode("utf-8")
+
+    body = single_flight(name, dataset_revision(), serialize)
+    return Response(body, media_type="application/json")
 
 
 @app.post("/sync")
@@ -70,74 +1220,141 @@ def sync_data(payload: Dict[str, Any]) -> Dict[str, Any]:
             status_code=400, detail="entriesByTopic is required and must be an object"
         )
 
-    JSON_DATA_DIR.mkdir(parents=True, exist_ok=True)
+    with span("validate"):
+        errors: List[Dict[str, str]] = []
+        for topic, entries in entries_by_topic.items():
+            validate_chunks(entries, f"entriesByTopic[{topic!r}]", errors)
+        if payload.get("booksMeta") is not None:
+            validate_books_meta(payload["booksMeta"], "booksMeta", errors)
+        raise_for_errors(errors)
 
-    # Save per-topic files and a combined manifest
-    saved_files = []
-    for topic, entries in entries_by_topic.items():
-        # Sanitize topic for filename
-        safe_name = (
-            "".join(c for c in topic if c.isalnum() or c in ("-", "_", " "))
-            .strip()
-            .replace(" ", "_")
-        )
-        if not safe_name:
-            safe_name = "topic"
-        path = JSON_DATA_DIR / f"{safe_name}.json"
-        with path.open("w", encoding="utf-8") as f:
-            json.dump(entries, f, ensure_ascii=False, indent=2)
-        saved_files.append(path.name)
+    TOPICS_DIR.mkdir(parents=True, exist_ok=True)
+    manifest_path = JSON_DATA_DIR / "manifest.json"
+
+    # Resolve each topic's storage id; a renamed topic keeps its id (and file)
+    with span("index"):
+        previous_index: Dict[str, str] = {}
+        if manifest_path.exists():
+            try:
+                stored = load_json(manifest_path)
+                if "topicIndex" not in stored:
+                    # Pre-topicIndex layout: move name-keyed files first so
+                    # they keep their ids instead of lingering as strays
+                    migrate_legacy_topics(stored)
+                    dump_json(stored, manifest_path)
+                previous_index = stored.get("topicIndex") or {}
+            except Exception:
+                pass
+        books_meta = dict(payload.get("booksMeta") or {})
+        topic_index = assign_topic_ids(list(entries_by_topic), books_meta, previous_index)
+        previous_ids = doc_chunk_ids()
+
+    # Save per-topic files (unchanged ones are skipped) and a combined manifest
+    with span("topics"):
+        saved_files = []
+        written_files = []
+        changed_docs = set()
+        for topic, entries in entries_by_topic.items():
+            doc_id = topic_index[topic]
+            if write_topic(doc_id, entries):
+                written_files.append(f"topics/{doc_id}.json")
+                changed_docs.add(doc_id)
+            saved_files.append(f"topics/{doc_id}.json")
 
     manifest = {
         "currentTopic": payload.get("currentTopic"),
         "orderCounters": payload.get("orderCounters", {}),
         "topicMeta": payload.get("topicMeta", {}),
-        "booksMeta": payload.get("booksMeta", {}),
+        "booksMeta": books_meta,
         "topics": list(entries_by_topic.keys()),
+        "topicIndex": topic_index,
         "files": saved_files,
     }
-    with (JSON_DATA_DIR / "manifest.json").open("w", encoding="utf-8") as f:
-        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    with span("manifest"):
+        dump_json(manifest, manifest_path)
+
+    # Edges to chunks or books this write deleted go with them
+    with span("gc"):
+        tombstones = record_deletions(
+            previous_ids,
+            {
+                topic_index[topic]: {e["id"] for e in entries}
+                for topic, entries in entries_by_topic.items()
+                if topic_index[topic] in changed_docs
+            },
+            set(topic_index.values()),
+            set(previous_index.values()) - set(topic_index.values()),
+        )
+        removed = prune_stored_edges(tombstones)
 
-    return {"status": "ok", "saved": saved_files}
+    # Files of deleted topics; the manifest no longer points at them
+    for doc_id in set(previous_index.values()) - set(topic_index.values()):
+        try:
+            topic_path(doc_id).unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Error deleting topic file {doc_id}: {e}")
+    refresh_overview()
+    refresh_corpus_stats()
+
+    return {"status": "ok", "saved": saved_files, "written": written_files, "removedEdges": removed}
 
 
-@app.get("/restore")
 def restore_data() -> Dict[str, Any]:
     """Return last saved dataset from json_data directory.
 
-    Combines per-topic files into entriesByTopic and loads manifest if present
-    for currentTopic and orderCounters.
+    Loads the manifest for currentTopic, orderCounters and the topic index,
+    then combines the per-topic files into entriesByTopic.
     """
     if not JSON_DATA_DIR.exists():
-        return {"entriesByTopic": {}, "orderCounters": {}, "currentTopic": None}
-
-    entries_by_topic: Dict[str, Any] = {}
-    for path in JSON_DATA_DIR.glob("*.json"):
-        # Skip manifest and graph_data (graph_data should be in graph/ folder now)
-        if path.name in ("manifest.json", "graph_data.json"):
-            continue
-        topic_name = path.stem.replace("_", " ")
-        try:
-            entries = json.loads(path.read_text(encoding="utf-8"))
-        except Exception:
-            entries = []
-        entries_by_topic[topic_name] = entries
+        return {
+            "entriesByTopic": {},
+            "orderCounters": {},
+            "currentTopic": None,
+            "topicMeta": {},
+            "booksMeta": {},
+        }
 
     current_topic = None
     order_counters: Dict[str, int] = {}
     topic_meta: Dict[str, Any] = {}
     books_meta: Dict[str, Any] = {}
+    topic_index: Optional[Dict[str, str]] = None
     manifest_path = JSON_DATA_DIR / "manifest.json"
-    if manifest_path.exists():
-        try:
-            manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
-            current_topic = manifest.get("currentTopic")
-            order_counters = manifest.get("orderCounters") or {}
-            topic_meta = manifest.get("topicMeta") or {}
-            books_meta = manifest.get("booksMeta") or {}
-        except Exception:
-            pass
+    with span("manifest"):
+        if manifest_path.exists():
+            try:
+                manifest = load_json(manifest_path, cached=True)
+                current_topic = manifest.get("currentTopic")
+                order_counters = manifest.get("orderCounters") or {}
+                topic_meta = manifest.get("topicMeta") or {}
+                books_meta = manifest.get("booksMeta") or {}
+                topic_index = manifest.get("topicIndex")
+            except Exception:
+                pass
+
+    with span("topics"):
+        entries_by_topic: Dict[str, Any] = {}
+        if topic_index is not None:
+            for topic_name, doc_id in topic_index.items():
+                try:
+                    entries = load_json(topic_path(doc_id), cached=True)
+                except Exception:
+                    entries = []
+                entries_by_topic[topic_name] = entries
+        else:
+            # Legacy layout: files named after the sanitized topic name
+            for path in JSON_DATA_DIR.glob("*.json"):
+                # Skip manifest and graph_data (graph_data should be in graph/ folder now)
+                if path.name in ("manifest.json", "graph_data.json"):
+                    continue
+                topic_name = path.stem.replace("_", " ")
+                try:
+                    entries = load_json(path, cached=True)
+                except Exception:
+                    entries = []
+                entries_by_topic[topic_name] = entries
 
     return {
         "entriesByTopic": entries_by_topic,
@@ -148,6 +1365,12 @@ def restore_data() -> Dict[str, Any]:
     }
 
 
+@app.get("/restore")
+def serve_restore() -> Response:
+    """Last saved dataset (restore_data), shared by concurrent requests."""
+    return coalesced_json("restore", restore_data)
+
+
 @app.post("/sync_graph")
 def sync_graph_data(payload: Dict[str, Any]) -> Dict[str, Any]:
     """Persist graph connections and books metadata to the server.
@@ -166,23 +1389,44 @@ def sync_graph_data(payload: Dict[str, Any]) -> Dict[str, Any]:
             status_code=400, detail="booksMeta is required and must be an object"
         )
 
+    with span("validate"):
+        errors: List[Dict[str, str]] = []
+        validate_books_meta(books_meta, "booksMeta", errors)
+        if graph_connections is not None:
+            if type(graph_connections) is not dict:
+                errors.append({"path": "graphConnections", "message": "must be an object"})
+            else:
+                for doc_id, connections in graph_connections.items():
+                    validate_connections(connections, f"graphConnections[{doc_id!r}]", errors)
+        raise_for_errors(errors)
+
+    # Drop edges to tombstoned chunks and books (the browser re-sends what
+    # /sync just pruned) and collapse duplicates; other endpoints may be
+    # chunks this server has not received yet, so they stay
+    with span("gc"):
+        graph_connections = dict(graph_connections or {})
+        tombstones = load_tombstones()
+        removed = collect_edge_garbage(
+            graph_connections, not_deleted(tombstones), set(tombstones["docs"])
+        )
+
     # Create graph directory if it doesn't exist
     GRAPH_DATA_DIR.mkdir(parents=True, exist_ok=True)
 
     # Save graph connections to graph/graph_data.json
-    graph_data_path = GRAPH_DATA_DIR / "graph_data.json"
-    graph_data = {
-        "booksMeta": books_meta,
-        "graphConnections": graph_connections or {},
-        "lastSync": json.loads(json.dumps({}))  # Timestamp placeholder
-    }
-    with graph_data_path.open("w", encoding="utf-8") as f:
-        json.dump(graph_data, f, ensure_ascii=False, indent=2)
+    with span("graph"):
+        graph_data_path = GRAPH_DATA_DIR / "graph_data.json"
+        graph_data = {
+            "booksMeta": books_meta,
+            "graphConnections": graph_connections,
+            "lastSync": json.loads(json.dumps({}))  # Timestamp placeholder
+        }
+        dump_json(graph_data, graph_data_path)
+    refresh_overview()
 
-    return {"status": "ok", "message": "Graph data synced successfully"}
+    return {"status": "ok", "message": "Graph data synced successfully", "removedEdges": removed}
 
 
-@app.get("/restore_graph")
 def restore_graph_data() -> Dict[str, Any]:
     """Return saved graph connections and books metadata.
 
@@ -194,7 +1438,8 @@ def restore_graph_data() -> Dict[str, Any]:
         return {"booksMeta": {}, "graphConnections": {}}
 
     try:
-        graph_data = json.loads(graph_data_path.read_text(encoding="utf-8"))
+        with span("graph"):
+            graph_data = load_json(graph_data_path, cached=True)
         return {
             "booksMeta": graph_data.get("booksMeta", {}),
             "graphConnections": graph_data.get("graphConnections", {})
@@ -203,6 +1448,1066 @@ def restore_graph_data() -> Dict[str, Any]:
         raise HTTPException(status_code=500, detail=f"Error reading graph data: {str(e)}")
 
 
+@app.get("/restore_graph")
+def serve_restore_graph() -> Response:
+    """Saved graph data (restore_graph_data), shared by concurrent requests."""
+    return coalesced_json("restore_graph", restore_graph_data)
+
+
+# Edge integrity. Writes only drop edges whose endpoints are known to be
+# deleted: a chunk that a /sync or re-import removed from the server, or a
+# book that a /sync removed. These are kept as tombstones, since the browser
+# may hold chunks the server has not seen yet and an edge to one of those
+# is not dangling. Graph-only syncs therefore delete nothing, they only
+# collapse duplicates (same source, target and type). fsck checks against
+# the stored chunks instead. Chunk-id sets per doc are cached against the
+# topic file, so a write only rebuilds the sets of the books it touched.
+TOMBSTONES_FILE = BASE_DIR / "cache" / "tombstones.json"
+TOMBSTONES_PER_DOC = 10_000
+
+_chunk_id_sets: Dict[str, Tuple[Optional[str], frozenset]] = {}
+
+
+def doc_chunk_ids() -> Dict[str, frozenset]:
+    """Chunk ids of every stored book, keyed by doc id."""
+    dataset = restore_data()
+    result: Dict[str, frozenset] = {}
+    for topic, meta in (dataset.get("booksMeta") or {}).items():
+        doc_id = meta.get("id") if isinstance(meta, dict) else None
+        entries = dataset["entriesByTopic"].get(topic)
+        if not isinstance(doc_id, str) or entries is None:
+            continue
+        signature = file_signature(topic_path(doc_id)) if DOC_ID_RE.match(doc_id) else None
+        cached = _chunk_id_sets.get(doc_id)
+        if cached is not None and signature is not None and cached[0] == signature:
+            result[doc_id] = cached[1]
+            continue
+        ids = frozenset(
+            e["id"] for e in entries if isinstance(entries, list)
+            and isinstance(e, dict) and isinstance(e.get("id"), str)
+        )
+        _chunk_id_sets[doc_id] = (signature, ids)
+        result[doc_id] = ids
+    for doc_id in set(_chunk_id_sets) - set(result):
+        del _chunk_id_sets[doc_id]
+    return result
+
+
+def load_tombstones() -> Dict[str, Any]:
+    tombstones = {"chunks": {}, "docs": []}
+    if TOMBSTONES_FILE.exists():
+        try:
+            tombstones.update(load_json(TOMBSTONES_FILE))
+        except Exception:
+            pass
+    return tombstones
+
+
+def record_deletions(
+    previous: Dict[str, frozenset],
+    current: Dict[str, set],
+    live_docs: set,
+    deleted_docs: set,
+) -> Dict[str, Any]:
+    """Update the tombstones after chunks were written; returns them.
+
+    previous and current hold the chunk ids of the rewritten docs before and
+    after the write. Ids that reappear are revived.
+    """
+    tombstones = load_tombstones()
+    chunks = dict(tombstones["chunks"])
+    for doc_id, ids in current.items():
+        dead = [i for i in chunks.get(doc_id, []) if i not in ids]
+        dead += sorted(previous.get(doc_id, frozenset()) - ids - set(dead))
+        if dead:
+            chunks[doc_id] = dead[-TOMBSTONES_PER_DOC:]
+        else:
+            chunks.pop(doc_id, None)
+    docs = sorted((set(tombstones["docs"]) - live_docs) | deleted_docs)
+    for doc_id in docs:
+        chunks.pop(doc_id, None)
+    updated = {"chunks": chunks, "docs": docs}
+    if updated != tombstones:
+        TOMBSTONES_FILE.parent.mkdir(parents=True, exist_ok=True)
+        dump_json(updated, TOMBSTONES_FILE)
+    return updated
+
+
+def collect_edge_garbage(
+    connections: Dict[str, Any],
+    is_live,
+    dead_docs: set,
+    docs: Optional[set] = None,
+) -> Dict[str, int]:
+    """Drop dangling and duplicate edges in place; returns what was removed.
+
+    is_live(doc_id, chunk_id) tells whether an endpoint may stay; edge lists
+    of dead_docs are removed entirely. With docs, only those lists are checked.
+    """
+    removed = {"dangling": 0, "duplicates": 0, "orphanDocs": 0}
+    for doc_id in list(connections):
+        if docs is not None and doc_id not in docs:
+            continue
+        conns = connections[doc_id]
+        if doc_id in dead_docs:
+            removed["orphanDocs"] += 1
+            removed["dangling"] += len(conns) if isinstance(conns, list) else 0
+            del connections[doc_id]
+            continue
+        seen = set()
+        kept = []
+        for conn in conns if isinstance(conns, list) else []:
+            if (
+                not isinstance(conn, dict)
+                or not is_live(doc_id, conn.get("source"))
+                or not is_live(doc_id, conn.get("target"))
+            ):
+                removed["dangling"] += 1
+                continue
+            key = (conn["source"], conn["target"], conn.get("type"))
+            if key in seen:
+                removed["duplicates"] += 1
+                continue
+            seen.add(key)
+            kept.append(conn)
+        if not isinstance(conns, list) or len(kept) != len(conns):
+            connections[doc_id] = kept
+    return removed
+
+
+def not_deleted(tombstones: Dict[str, Any]):
+    """is_live for collect_edge_garbage: anything but tombstoned chunks."""
+    dead = {doc_id: set(ids) for doc_id, ids in tombstones["chunks"].items()}
+    return lambda doc_id, chunk_id: chunk_id not in dead.get(doc_id, ())
+
+
+def prune_stored_edges(tombstones: Dict[str, Any], docs: Optional[set] = None) -> Dict[str, int]:
+    """Remove stored edges that touch deleted chunks or books."""
+    removed = {"dangling": 0, "duplicates": 0, "orphanDocs": 0}
+    graph_data_path = GRAPH_DATA_DIR / "graph_data.json"
+    if not graph_data_path.exists():
+        return removed
+    graph_data = load_json(graph_data_path, cached=True)
+    # Shallow copy: collect_edge_garbage replaces lists rather than editing them
+    connections = dict(graph_data.get("graphConnections") or {})
+    removed = collect_edge_garbage(
+        connections, not_deleted(tombstones), set(tombstones["docs"]), docs
+    )
+    if any(removed.values()):
+        dump_json({**graph_data, "graphConnections": connections}, graph_data_path)
+    return removed
+
+
+def fsck(repair: bool = False) -> Dict[str, Any]:
+    """Check the whole json_data/graph tree in one pass; optionally repair it.
+
+    Repairs only drop invalid edges, realign booksMeta ids with the topic
+    index and delete topic files the index no longer references (left by
+    deleted topics); chunk problems are reported for manual fixing.
+    """
+    problems: List[Dict[str, str]] = []
+    manifest_path = JSON_DATA_DIR / "manifest.json"
+    manifest: Dict[str, Any] = {}
+    if manifest_path.exists():
+        try:
+            manifest = load_json(manifest_path)
+        except Exception as e:
+            problems.append({"path": "manifest.json", "message": f"unreadable: {e}"})
+    topic_index = manifest.get("topicIndex")
+    if manifest and topic_index is None:
+        problems.append({"path": "manifest.json", "message": "legacy layout without topicIndex"})
+    topic_index = topic_index or {}
+
+    # Topic files: referenced ones must parse and validate, others are strays
+    chunk_count = 0
+    for topic, doc_id in topic_index.items():
+        path = topic_path(doc_id)
+        if not path.exists():
+            problems.append({"path": f"topics/{doc_id}.json", "message": f"missing file for {topic!r}"})
+            continue
+        try:
+            entries = load_json(path, cached=True)
+        except Exception as e:
+            problems.append({"path": f"topics/{doc_id}.json", "message": f"unreadable: {e}"})
+            continue
+        validate_chunks(entries, f"topics/{doc_id}.json", problems)
+        chunk_count += len(entries) if isinstance(entries, list) else 0
+    referenced = {f"{doc_id}.json" for doc_id in topic_index.values()}
+    strays = [
+        path for path in (sorted(TOPICS_DIR.glob("*.json")) if TOPICS_DIR.exists() else [])
+        if path.name not in referenced
+    ]
+    for path in strays:
+        problems.append({"path": f"topics/{path.name}", "message": "not referenced by the manifest"})
+    # Name-keyed files from before topics/ existed; migration moves them
+    for path in sorted(JSON_DATA_DIR.glob("*.json")) if JSON_DATA_DIR.exists() else []:
+        if path.name not in ("manifest.json", "graph_data.json"):
+            problems.append({"path": path.name, "message": "legacy root-level topic file"})
+
+    books_meta = manifest.get("booksMeta") or {}
+    realigned = 0
+    for topic, doc_id in topic_index.items():
+        meta = books_meta.get(topic)
+        if not isinstance(meta, dict) or meta.get("id") != doc_id:
+            problems.append({"path": f"booksMeta[{topic!r}]", "message": f"id does not match {doc_id!r}"})
+            books_meta[topic] = {"name": topic, **(meta if isinstance(meta, dict) else {}), "id": doc_id}
+            realigned += 1
+
+    graph_data_path = GRAPH_DATA_DIR / "graph_data.json"
+    graph_data: Dict[str, Any] = {}
+    if graph_data_path.exists():
+        try:
+            graph_data = load_json(graph_data_path)
+        except Exception as e:
+            problems.append({"path": "graph_data.json", "message": f"unreadable: {e}"})
+    connections = graph_data.get("graphConnections")
+    if not isinstance(connections, dict):
+        connections = {}
+    edge_count = sum(len(c) for c in connections.values() if isinstance(c, list))
+    chunk_ids = doc_chunk_ids()
+    removed = collect_edge_garbage(
+        connections,
+        lambda doc_id, chunk_id: chunk_id in chunk_ids.get(doc_id, ()),
+        set(connections) - set(chunk_ids),
+    )
+    labels = {
+        "dangling": "edges with a missing endpoint",
+        "duplicates": "duplicate edges",
+        "orphanDocs": "edge lists of unknown books",
+    }
+    for kind, count in removed.items():
+        if count:
+            problems.append({"path": "graph_data.json", "message": f"{count} {labels[kind]}"})
+
+    if repair and realigned:
+        manifest["booksMeta"] = books_meta
+        dump_json(manifest, manifest_path)
+    if repair and any(removed.values()):
+        graph_data["graphConnections"] = connections
+        dump_json(graph_data, graph_data_path)
+    # Without a readable topic index every file would look unreferenced
+    if repair and "topicIndex" in manifest:
+        for path in strays:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+    if repair and (realigned or any(removed.values())):
+        refresh_overview()
+
+    return {
+        "ok": not problems,
+        "repaired": repair,
+        "topics": len(topic_index),
+        "chunks": chunk_count,
+        "edges": edge_count,
+        "removedEdges": removed,
+        "problemCount": len(problems),
+        "problems": problems[:MAX_REPORTED_ERRORS],
+    }
+
+
+@app.post("/fsck")
+def run_fsck(repair: bool = False) -> Dict[str, Any]:
+    """Verify the stored dataset; ?repair=true also fixes what it safely can."""
+    return fsck(repair)
+
+
+# Cross-book overview, kept as a small aggregate document next to the other
+# derived caches. Writes refresh it; each book's stats carry the stat
+# signature of its topic file so only books whose file changed are
+# recounted. Edge stats need the chunk -> book map and are rebuilt whenever
+# a book or the graph file changed.
+OVERVIEW_FILE = BASE_DIR / "cache" / "overview.json"
+
+_overview_lock = threading.Lock()
+
+
+def file_signature(path: Path) -> Optional[str]:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return f"{st.st_mtime_ns}:{st.st_size}"
+
+
+def dataset_revision() -> str:
+    """Identify the stored dataset by its manifest and graph files."""
+    return "|".join(
+        file_signature(path) or "-"
+        for path in (JSON_DATA_DIR / "manifest.json", GRAPH_DATA_DIR / "graph_data.json")
+    )
+
+
+def book_overview(doc_id: str, name: str, entries: Any, signature: Optional[str]) -> Dict[str, Any]:
+    depths: Counter = Counter()
+    for entry in entries if isinstance(entries, list) else []:
+        depth = entry.get("depth") if isinstance(entry, dict) else None
+        depths[str(depth) if type(depth) is int else "none"] += 1
+    return {
+        "docId": doc_id,
+        "name": name,
+        "nodeCount": sum(depths.values()),
+        "depthHistogram": dict(sorted(depths.items())),
+        "signature": signature,
+    }
+
+
+def update_overview() -> Dict[str, Any]:
+    """Bring the overview document up to date with the stored dataset."""
+    with _overview_lock:
+        previous: Dict[str, Any] = {}
+        if OVERVIEW_FILE.exists():
+            try:
+                previous = load_json(OVERVIEW_FILE, cached=True)
+            except Exception:
+                previous = {}
+        revision = dataset_revision()
+        if previous.get("revision") == revision:
+            return previous
+
+        dataset = restore_data()
+        graph_signature = file_signature(GRAPH_DATA_DIR / "graph_data.json")
+        known = {book["docId"]: book for book in previous.get("books", [])}
+        books: List[Dict[str, Any]] = []
+        chunk_ids = dict(doc_chunk_ids())
+        changed = graph_signature != previous.get("graphSignature") or len(known) != len(
+            dataset["entriesByTopic"]
+        )
+        with span("books"):
+            for name, entries in dataset["entriesByTopic"].items():
+                meta = dataset["booksMeta"].get(name)
+                doc_id = meta.get("id") if isinstance(meta, dict) and meta.get("id") else name
+                signature = file_signature(topic_path(doc_id)) if DOC_ID_RE.match(doc_id) else None
+                book = known.get(doc_id)
+                if book is None or book["name"] != name or not signature or book["signature"] != signature:
+                    book = book_overview(doc_id, name, entries, signature)
+                    changed = True
+                else:
+                    book = dict(book)  # previous is a read-only cached document
+                books.append(book)
+                if doc_id not in chunk_ids:  # books without an id in booksMeta
+                    chunk_ids[doc_id] = frozenset(
+                        e["id"] for e in entries if isinstance(entries, list)
+                        and isinstance(e, dict) and isinstance(e.get("id"), str)
+                    )
+
+        overview = {
+            "revision": revision,
+            "graphSignature": graph_signature,
+            "bookCount": len(books),
+            "nodeCount": sum(book["nodeCount"] for book in books),
+        }
+        if changed:
+            # Edges are attributed to the book they are stored under; only
+            # those with both ends present count, as in graph.js's overview
+            with span("edges"):
+                per_book: Dict[str, Dict[str, Counter]] = {}
+                bundles: Dict[Tuple[str, str], Counter] = {}
+                by_type: Counter = Counter()
+                dangling = 0
+                # Endpoints are looked up in the edge's own book first; only
+                # cross-book endpoints search the other books (memoized)
+                foreign: Dict[Any, Optional[str]] = {}
+
+                def owner(chunk_id, doc_id: str) -> Optional[str]:
+                    if chunk_id in chunk_ids.get(doc_id, ()):
+                        return doc_id
+                    if chunk_id not in foreign:
+                        foreign[chunk_id] = next(
+                            (other for other, ids in chunk_ids.items() if chunk_id in ids), None
+                        )
+                    return foreign[chunk_id]
+
+                connections = restore_graph_data()["graphConnections"]
+                for doc_id, conns in connections.items():
+                    for conn in conns if isinstance(conns, list) else []:
+                        if not isinstance(conn, dict):
+                            continue
+                        source = owner(conn.get("source"), doc_id)
+                        target = owner(conn.get("target"), doc_id)
+                        if source is None or target is None:
+                            dangling += 1
+                            continue
+                        link_type = conn.get("type") or "default"
+                        by_type[link_type] += 1
+                        per_book.setdefault(doc_id, {}).setdefault("types", Counter())[link_type] += 1
+                        if source != target:
+                            bundles.setdefault((source, target), Counter())[link_type] += 1
+            for book in books:
+                types = per_book.get(book["docId"], {}).get("types", Counter())
+                book["edgeCount"] = sum(types.values())
+                book["edgesByType"] = dict(types)
+            overview.update(
+                edgeCount=sum(by_type.values()),
+                edgesByType=dict(by_type),
+                danglingEdges=dangling,
+                bundles=[
+                    {"source": s, "target": t, "count": sum(types.values()), "byType": dict(types)}
+                    for (s, t), types in sorted(bundles.items())
+                ],
+            )
+        else:
+            for key in ("edgeCount", "edgesByType", "danglingEdges", "bundles"):
+                overview[key] = previous.get(key)
+        overview["books"] = books
+
+        OVERVIEW_FILE.parent.mkdir(parents=True, exist_ok=True)
+        dump_json(overview, OVERVIEW_FILE)
+        return overview
+
+
+def refresh_overview() -> None:
+    """Update the overview after a write without failing the write itself."""
+    try:
+        with span("overview"):
+            update_overview()
+    except Exception as e:
+        print(f"Overview update failed: {e}")
+
+
+@app.get("/overview")
+def serve_overview() -> Dict[str, Any]:
+    """Aggregated all-books view: per-book node counts and depth histograms,
+    edge counts by link type and inter-book edge bundles.
+    """
+    overview = update_overview()
+    result = {k: v for k, v in overview.items() if k not in ("revision", "graphSignature")}
+    result["books"] = [
+        {k: v for k, v in book.items() if k != "signature"} for book in overview["books"]
+    ]
+    return result
+
+
+# Corpus statistics. Word, character and token-estimate counts are kept per
+# chunk keyed by a hash of its input text, so a sync only counts chunks whose
+# text changed; per-topic count arrays are cached against the topic file and
+# aggregated with NumPy. Word counts split on whitespace like script.js's
+# getWordCount. There is no tokenizer dependency: tokens are estimated per
+# run of letters, ~4 characters per token for Latin script and ~2 for
+# Persian/Arabic (which BPE vocabularies split much finer), plus one per
+# punctuation mark.
+CHUNK_STATS_FILE = BASE_DIR / "cache" / "chunk_stats.json"
+TOKEN_CHARS_LATIN = 4
+TOKEN_CHARS_OTHER = 2
+WORD_BUCKETS = (150, 725)  # badgeColor thresholds in script.js
+TOKEN_RUN_RE = re.compile(r"([A-Za-z0-9]+)|([^\W_]+)|([^\w\s])")
+
+_chunk_stats: Optional[Dict[str, List[int]]] = None
+_topic_stats: Dict[str, Tuple[Optional[str], Any]] = {}
+_stats_lock = threading.Lock()
+
+
+def estimate_tokens(text: str) -> int:
+    tokens = 0
+    for latin, other, _ in TOKEN_RUN_RE.findall(text):
+        if latin:
+            tokens += -(-len(latin) // TOKEN_CHARS_LATIN)
+        elif other:
+            tokens += -(-len(other) // TOKEN_CHARS_OTHER)
+        else:
+            tokens += 1
+    return tokens
+
+
+def chunk_counts(text: str) -> List[int]:
+    """[words, characters, estimated tokens] for a chunk's text."""
+    return [len(text.split()), len(text), estimate_tokens(text)]
+
+
+def topic_stats_array(topic: str, doc_id: Optional[str], entries: Any):
+    """(n, 3) array of per-chunk counts, recounting only unseen texts."""
+    signature = file_signature(topic_path(doc_id)) if doc_id and DOC_ID_RE.match(doc_id) else None
+    cached = _topic_stats.get(topic)
+    hit = cached is not None and signature is not None and cached[0] == signature
+    record_cache("topic_stats", hit)
+    if hit:
+        return cached[1]
+    rows = []
+    for entry in entries if isinstance(entries, list) else []:
+        text = entry.get("input") if isinstance(entry, dict) else None
+        text = text if isinstance(text, str) else ""
+        key = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        counts = _chunk_stats.get(key)
+        if counts is None:
+            counts = _chunk_stats[key] = chunk_counts(text)
+        rows.append(counts)
+    array = np.array(rows, dtype=np.int64).reshape(-1, 3)
+    _topic_stats[topic] = (signature, array)
+    return array
+
+
+def summarize_counts(array) -> Dict[str, Any]:
+    words, chars, tokens = array[:, 0], array[:, 1], array[:, 2]
+    n = len(array)
+    buckets = np.bincount(np.searchsorted(WORD_BUCKETS, words, side="right"), minlength=3)
+
+    def dist(values) -> Dict[str, float]:
+        if not n:
+            return {"mean": 0, "median": 0, "p90": 0, "max": 0}
+        p50, p90 = np.percentile(values, [50, 90])
+        return {"mean": round(float(values.mean()), 1), "median": float(p50),
+                "p90": float(p90), "max": int(values.max())}
+
+    return {
+        "chunks": n,
+        "words": int(words.sum()),
+        "characters": int(chars.sum()),
+        "tokens": int(tokens.sum()),
+        "wordDistribution": dist(words),
+        "tokenDistribution": dist(tokens),
+        "wordBuckets": {
+            f"<{WORD_BUCKETS[0]}": int(buckets[0]),
+            f"{WORD_BUCKETS[0]}-{WORD_BUCKETS[1] - 1}": int(buckets[1]),
+            f">={WORD_BUCKETS[1]}": int(buckets[2]),
+        },
+    }
+
+
+def corpus_stats() -> Dict[str, Any]:
+    """Per-topic and corpus-wide count totals and distributions."""
+    global _chunk_stats
+    with _stats_lock:
+        if _chunk_stats is None:
+            _chunk_stats = {}
+            if CHUNK_STATS_FILE.exists():
+                try:
+                    _chunk_stats = load_json(CHUNK_STATS_FILE)
+                except Exception:
+                    pass
+        known = len(_chunk_stats)
+
+        dataset = restore_data()
+        arrays = {}
+        with span("count"):
+            for topic, entries in dataset["entriesByTopic"].items():
+                meta = dataset["booksMeta"].get(topic)
+                doc_id = meta.get("id") if isinstance(meta, dict) else None
+                arrays[topic] = topic_stats_array(topic, doc_id, entries)
+        for topic in set(_topic_stats) - set(arrays):
+            del _topic_stats[topic]
+
+        # Persist new counts for other workers and restarts; drop texts that
+        # no longer occur once the cache has grown well past the corpus
+        total_chunks = sum(len(a) for a in arrays.values())
+        if len(_chunk_stats) > 2 * total_chunks + 1000:
+            live = set()
+            for entries in dataset["entriesByTopic"].values():
+                for entry in entries if isinstance(entries, list) else []:
+                    text = entry.get("input") if isinstance(entry, dict) else None
+                    text = text if isinstance(text, str) else ""
+                    live.add(hashlib.sha1(text.encode("utf-8")).hexdigest())
+            _chunk_stats = {k: v for k, v in _chunk_stats.items() if k in live}
+            known = -1
+        if len(_chunk_stats) != known:
+            CHUNK_STATS_FILE.parent.mkdir(parents=True, exist_ok=True)
+            dump_json(_chunk_stats, CHUNK_STATS_FILE)
+
+        with span("aggregate"):
+            corpus = np.concatenate(list(arrays.values())) if arrays else np.zeros((0, 3), np.int64)
+            return {
+                "corpus": {"topics": len(arrays), **summarize_counts(corpus)},
+                "topics": {topic: summarize_counts(array) for topic, array in arrays.items()},
+                "tokenEstimate": {
+                    "charsPerTokenLatin": TOKEN_CHARS_LATIN,
+                    "charsPerTokenOther": TOKEN_CHARS_OTHER,
+                },
+            }
+
+
+def refresh_corpus_stats() -> None:
+    """Count changed chunks right after a write so /stats stays cheap."""
+    if np is None:
+        return
+    try:
+        with span("stats"):
+            corpus_stats()
+    except Exception as e:
+        print(f"Stats update failed: {e}")
+
+
+@app.get("/stats")
+def serve_stats() -> Dict[str, Any]:
+    """Word, character and estimated token counts per topic and corpus-wide."""
+    if np is None:
+        raise HTTPException(status_code=503, detail="numpy is required for corpus statistics")
+    return corpus_stats()
+
+
+# Server-side force-directed graph layout (Fruchterman-Reingold on NumPy).
+# Positions are in pixels around (0, 0) with ~LAYOUT_EDGE_LENGTH per edge,
+# matching the link distance graph.js uses, and cached per doc keyed by a
+# hash of the node and edge set. A changed graph starts from the previous
+# positions and only needs a short, cool re-run.
+LAYOUT_EDGE_LENGTH = 100.0
+LAYOUT_ITERATIONS = 150
+LAYOUT_INCREMENTAL_ITERATIONS = 40
+LAYOUT_EXACT_LIMIT = 1000  # above this, far-field repulsion uses cells
+LAYOUT_CELL_SIZE = 64  # max nodes per cell, raised to sqrt(n) for large graphs
+LAYOUT_BLOCK = 512  # rows per block when building pairwise matrices
+LAYOUT_TIME_BUDGET = 20.0  # seconds; later iterations are skipped past this
+LAYOUT_MEMORY_CACHE = 32
+
+_layout_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+# Guards the in-memory LRU caches below, which threadpool requests share
+_lru_lock = threading.Lock()
+
+
+def lru_get(cache: OrderedDict, key: str) -> Any:
+    with _lru_lock:
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+
+def lru_put(cache: OrderedDict, key: str, value: Any, limit: int) -> None:
+    with _lru_lock:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > limit:
+            cache.popitem(last=False)
+
+
+def layout_key(node_ids: List[str], edges: List[Tuple[str, str]]) -> str:
+    digest = hashlib.sha1()
+    for node_id in sorted(node_ids):
+        digest.update(node_id.encode("utf-8") + b"\0")
+    digest.update(b"\1")
+    for source, target in sorted(edges):
+        digest.update(f"{source}\0{target}\0".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _pairwise_repulsion(pos, others, weights, k2):
+    """Sum k^2 * w / d along (pos - other) for every pos row, in blocks."""
+    disp = np.empty_like(pos)
+    ox, oy = others[:, 0], others[:, 1]
+    kw = k2 * weights
+    for start in range(0, len(pos), LAYOUT_BLOCK):
+        block = pos[start:start + LAYOUT_BLOCK]
+        dx = block[:, 0, None] - ox
+        dy = block[:, 1, None] - oy
+        scale = dx * dx
+        scale += dy * dy
+        np.maximum(scale, 1e-2, out=scale)
+        np.divide(kw, scale, out=scale)
+        disp[start:start + LAYOUT_BLOCK, 0] = np.einsum("ij,ij->i", dx, scale)
+        disp[start:start + LAYOUT_BLOCK, 1] = np.einsum("ij,ij->i", dy, scale)
+    return disp
+
+
+def _partition_cells(pos, cell_size):
+    """Split nodes by recursive median cuts across the wider axis of each box.
+
+    Every leaf holds between cell_size // 2 and cell_size nodes, however
+    elongated, diagonal or clustered the layout is.
+    """
+    cells = []
+    pending = [np.arange(len(pos))]
+    while pending:
+        members = pending.pop()
+        if len(members) <= cell_size:
+            cells.append(members)
+            continue
+        points = pos[members]
+        axis = int(np.argmax(points.max(axis=0) - points.min(axis=0)))
+        half = len(members) // 2
+        split = np.argpartition(points[:, axis], half)
+        pending.append(members[split[:half]])
+        pending.append(members[split[half:]])
+    return cells
+
+
+def _grid_repulsion(pos, k2):
+    """Barnes-Hut style approximation: far cells act through their centroid.
+
+    Cells come from _partition_cells with about sqrt(n) nodes each, which
+    balances the far field (n x cells) against the exact near field (n x
+    cell size) at O(n^1.5) per step.
+    """
+    n = len(pos)
+    cell_size = max(LAYOUT_CELL_SIZE, math.isqrt(n))
+    cells = _partition_cells(pos, cell_size)
+    counts = np.array([len(members) for members in cells])
+    centroids = np.stack([pos[members].mean(axis=0) for members in cells])
+
+    # Far field from every cell, minus the node's own cell term
+    disp = _pairwise_repulsion(pos, centroids, counts.astype(np.float64), k2)
+    own = np.empty(n, dtype=np.int64)
+    for i, members in enumerate(cells):
+        own[members] = i
+    delta = pos - centroids[own]
+    dist2 = np.maximum(np.einsum("ij,ij->i", delta, delta), 1e-2)
+    disp -= delta * (k2 * counts[own] / dist2)[:, None]
+
+    # Near field: exact repulsion inside each cell, batched by padding cells
+    # to cell_size (padding sits far away); batches hold about BLOCK^2 pairs
+    batch = max(1, LAYOUT_BLOCK * LAYOUT_BLOCK // (cell_size * cell_size))
+    for start in range(0, len(cells), batch):
+        group = cells[start:start + batch]
+        rows = np.repeat(np.arange(len(group)), [len(members) for members in group])
+        cols = np.concatenate([np.arange(len(members)) for members in group])
+        index = np.concatenate(group)
+        padded = np.full((len(group), cell_size, 2), 1e12)
+        padded[rows, cols] = pos[index]
+        dx = padded[:, :, None, 0] - padded[:, None, :, 0]
+        dy = padded[:, :, None, 1] - padded[:, None, :, 1]
+        scale = k2 / np.maximum(dx * dx + dy * dy, 1e-2)
+        disp[index, 0] += (dx * scale).sum(axis=2)[rows, cols]
+        disp[index, 1] += (dy * scale).sum(axis=2)[rows, cols]
+    return disp
+
+
+def compute_layout(pos, sources, targets, iterations: int, temperature: float):
+    """Run Fruchterman-Reingold steps in place on an (n, 2) position array.
+
+    Stops early once LAYOUT_TIME_BUDGET is spent, keeping the positions
+    reached so far.
+    """
+    k = LAYOUT_EDGE_LENGTH
+    k2 = k * k
+    n = len(pos)
+    cooling = (0.01) ** (1.0 / max(iterations, 1))
+    deadline = time.monotonic() + LAYOUT_TIME_BUDGET
+    for _ in range(iterations):
+        if time.monotonic() > deadline:
+            print(f"Layout of {n} nodes stopped early at the time budget")
+            break
+        if n <= LAYOUT_EXACT_LIMIT:
+            disp = _pairwise_repulsion(pos, pos, np.ones(n), k2)
+        else:
+            disp = _grid_repulsion(pos, k2)
+        if len(sources):
+            delta = pos[sources] - pos[targets]
+            dist = np.sqrt(np.einsum("ij,ij->i", delta, delta))[:, None]
+            pull = delta * dist / k
+            np.subtract.at(disp, sources, pull)
+            np.add.at(disp, targets, pull)
+        # Weak gravity keeps disconnected chunks from drifting apart
+        disp -= pos * (0.01 * np.sqrt(n))
+        length = np.maximum(np.sqrt(np.einsum("ij,ij->i", disp, disp)), 1e-9)[:, None]
+        pos += disp / length * np.minimum(length, temperature)
+        temperature *= cooling
+    pos -= pos.mean(axis=0)
+    return pos
+
+
+def get_doc_layout(doc_id: str) -> Dict[str, Any]:
+    """Return cached node positions for a doc, computing them if needed."""
+    dataset = restore_data()
+    topic = next(
+        (name for name, meta in dataset.get("booksMeta", {}).items()
+         if isinstance(meta, dict) and meta.get("id") == doc_id),
+        None,
+    )
+    if topic is None or topic not in dataset["entriesByTopic"]:
+        raise HTTPException(status_code=404, detail="کتاب موردنظر یافت نشد")
+
+    chunks = sorted(
+        (c for c in dataset["entriesByTopic"][topic] if isinstance(c, dict) and "id" in c),
+        key=lambda c: c.get("order") if type(c.get("order")) in (int, float) else 0,
+    )
+    node_ids = [c["id"] for c in chunks]
+    index = {node_id: i for i, node_id in enumerate(node_ids)}
+    connections = restore_graph_data()["graphConnections"].get(doc_id) or []
+    edges = [
+        (c["source"], c["target"]) for c in connections
+        if isinstance(c, dict) and c.get("source") in index and c.get("target") in index
+    ]
+    key = layout_key(node_ids, edges)
+
+    cached = lru_get(_layout_cache, doc_id)
+    cache_path = LAYOUTS_DIR / f"{doc_id}.json"
+    if cached is None and cache_path.exists():
+        try:
+            cached = load_json(cache_path)
+        except Exception:
+            cached = None
+    hit = cached is not None and cached.get("key") == key
+    record_cache("graph_layout", hit)
+    if hit:
+        lru_put(_layout_cache, doc_id, cached, LAYOUT_MEMORY_CACHE)
+        return {**cached, "cached": True}
+    # Concurrent requests for the same graph wait for one computation
+    layout = single_flight(
+        "graph_layout", f"{doc_id}:{key}",
+        lambda: build_doc_layout(doc_id, key, node_ids, index, edges, cached),
+    )
+    return {**layout, "cached": False}
+
+
+def build_doc_layout(doc_id, key, node_ids, index, edges, cached) -> Dict[str, Any]:
+    """Compute, store and cache a doc's layout (see get_doc_layout)."""
+    n = len(node_ids)
+    sources = np.array([index[s] for s, _ in edges], dtype=np.int64)
+    targets = np.array([index[t] for _, t in edges], dtype=np.int64)
+
+    # Seed from previous positions where possible, new nodes next to a
+    # placed neighbour, everything else on a phyllotaxis spiral by order
+    previous = (cached or {}).get("nodes") or {}
+    golden = np.pi * (3 - np.sqrt(5))
+    steps = np.arange(n)
+    radius = LAYOUT_EDGE_LENGTH * 0.5 * np.sqrt(steps + 1)
+    pos = np.stack([radius * np.cos(steps * golden), radius * np.sin(steps * golden)], axis=1)
+    known = np.zeros(n, dtype=bool)
+    for node_id, i in index.items():
+        if node_id in previous:
+            pos[i] = previous[node_id]
+            known[i] = True
+    for s, t in zip(sources, targets):
+        for a, b in ((s, t), (t, s)):
+            if not known[a] and known[b]:
+                pos[a] = pos[b] + np.random.default_rng(a).normal(0, 10, 2)
+                known[a] = True
+
+    incremental = bool(previous) and bool(known.mean() > 0.5)
+    with span("layout"):
+        if incremental:
+            compute_layout(pos, sources, targets, LAYOUT_INCREMENTAL_ITERATIONS, LAYOUT_EDGE_LENGTH)
+        else:
+            compute_layout(pos, sources, targets, LAYOUT_ITERATIONS, LAYOUT_EDGE_LENGTH * np.sqrt(n))
+
+    layout = {
+        "docId": doc_id,
+        "key": key,
+        "nodeCount": n,
+        "edgeCount": len(edges),
+        "incremental": incremental,
+        "nodes": {node_id: [round(float(x), 1), round(float(y), 1)]
+                  for node_id, (x, y) in zip(node_ids, pos)},
+    }
+    LAYOUTS_DIR.mkdir(parents=True, exist_ok=True)
+    dump_json(layout, LAYOUTS_DIR / f"{doc_id}.json")
+    lru_put(_layout_cache, doc_id, layout, LAYOUT_MEMORY_CACHE)
+    return layout
+
+
+@app.get("/graph_layout/{doc_id}")
+def graph_layout(doc_id: str) -> Dict[str, Any]:
+    """Precomputed node positions for a book's graph (see get_doc_layout)."""
+    if np is None:
+        raise HTTPException(status_code=503, detail="numpy is required for server-side layouts")
+    if not DOC_ID_RE.match(doc_id):
+        raise HTTPException(status_code=400, detail="فیلد docId نامعتبر است")
+    return get_doc_layout(doc_id)
+
+
+# Link suggestions from TF-IDF cosine similarity, computed locally with
+# NumPy (sparse rows kept as CSR arrays; there is no SciPy dependency).
+# Text is normalized for Persian (Arabic letter forms, diacritics, tatweel,
+# ZWNJ, Persian/Arabic digits) before tokenizing. Term counts are cached per
+# chunk text hash, so only edited chunks are re-tokenized; the neighbour
+# lists of a book are cached under a key of its chunk ids and text hashes
+# and filtered against the current edges per request.
+SIMILARITY_DIR = BASE_DIR / "cache" / "similarity"
+SIMILARITY_MAX_K = 20  # neighbours cached per chunk; requests may ask for fewer
+SIMILARITY_MAX_DF = 0.5  # terms in more than this share of chunks are ignored
+SIMILARITY_BLOCK_CELLS = 4_000_000  # rows * chunks per score block
+SIMILARITY_MEMORY_CACHE = 32
+TERM_CACHE_MAX = 200_000
+
+PERSIAN_TRANSLATION = str.maketrans({
+    "ي": "ی", "ى": "ی", "ئ": "ی", "ك": "ک", "ة": "ه", "ۀ": "ه",
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا", "ؤ": "و",
+    "\u200c": " ", "\u200f": None, "ـ": None,
+    **{chr(c): None for c in range(0x064B, 0x0660)}, "ٰ": None,
+    **{chr(0x06F0 + d): str(d) for d in range(10)},
+    **{chr(0x0660 + d): str(d) for d in range(10)},
+})
+TERM_RE = re.compile(r"[^\W_]{2,}")
+PERSIAN_STOPWORDS = frozenset(
+    "و در به از که این را با است برای ان یک تا هم بر می ها های شود شده کرد کند "
+    "باید بود نیز او ما شما انها اند ای یا اما اگر چه هر همه وی خود دیگر نیست "
+    "the and of to in is for on with as by an be or that this it".split()
+)
+
+_term_cache: "OrderedDict[str, Dict[str, int]]" = OrderedDict()
+_similarity_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+
+def normalize_persian(text: str) -> str:
+    return text.translate(PERSIAN_TRANSLATION).lower()
+
+
+def chunk_terms(text: str) -> Dict[str, int]:
+    """Term counts for a chunk's text, cached by content hash."""
+    key = hashlib.sha1(text.encode("utf-8")).hexdigest()
+    terms = lru_get(_term_cache, key)
+    if terms is None:
+        terms = dict(Counter(
+            t for t in TERM_RE.findall(normalize_persian(text)) if t not in PERSIAN_STOPWORDS
+        ))
+        lru_put(_term_cache, key, terms, TERM_CACHE_MAX)
+    return terms
+
+
+def tfidf_rows(documents: List[Dict[str, int]]):
+    """L2-normalized sublinear TF-IDF rows as CSR (indptr, indices, data)."""
+    n = len(documents)
+    df: Counter = Counter()
+    for terms in documents:
+        df.update(terms.keys())
+    # Terms in a single chunk cannot link two chunks
+    max_df = SIMILARITY_MAX_DF * n if n >= 10 else n
+    vocab = {t: i for i, t in enumerate(t for t, c in df.items() if 1 < c <= max_df)}
+    idf = np.empty(len(vocab))
+    for t, i in vocab.items():
+        idf[i] = np.log((1 + n) / (1 + df[t])) + 1
+
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    indices: List[int] = []
+    counts: List[int] = []
+    for row, terms in enumerate(documents):
+        for t, c in terms.items():
+            col = vocab.get(t)
+            if col is not None:
+                indices.append(col)
+                counts.append(c)
+        indptr[row + 1] = len(indices)
+    indices_arr = np.array(indices, dtype=np.int64)
+    data = (1 + np.log(np.array(counts, dtype=np.float64))) * idf[indices_arr]
+    lengths = np.diff(indptr)
+    row_of = np.repeat(np.arange(n), lengths)
+    norms = np.sqrt(np.bincount(row_of, weights=data ** 2, minlength=n))
+    norms[norms == 0] = 1.0
+    data /= norms[row_of]
+    return indptr, indices_arr, data
+
+
+def top_k_similar(indptr, indices, data, k: int):
+    """Top-k cosine neighbours per row via blocked sparse X @ X.T."""
+    n = len(indptr) - 1
+    k = min(k, n - 1)
+    if k <= 0:
+        return np.zeros((n, 0), dtype=np.int64), np.zeros((n, 0))
+
+    # Transpose once: for every term, the rows containing it
+    order = np.argsort(indices, kind="stable")
+    row_of = np.repeat(np.arange(n), np.diff(indptr))
+    t_rows, t_data = row_of[order], data[order]
+    t_indptr = np.zeros(int(indices.max(initial=-1)) + 2, dtype=np.int64)
+    np.cumsum(np.bincount(indices, minlength=len(t_indptr) - 1), out=t_indptr[1:])
+
+    neighbours = np.empty((n, k), dtype=np.int64)
+    scores = np.empty((n, k))
+    block = max(1, min(n, SIMILARITY_BLOCK_CELLS // n))
+    for start in range(0, n, block):
+        stop = min(n, start + block)
+        lo, hi = indptr[start], indptr[stop]
+        terms, weights = indices[lo:hi], data[lo:hi]
+        rows = row_of[lo:hi] - start
+        # Expand each (row, term) into the term's posting list
+        lengths = t_indptr[terms + 1] - t_indptr[terms]
+        total = int(lengths.sum())
+        offsets = np.arange(total) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        positions = np.repeat(t_indptr[terms], lengths) + offsets
+        sim = np.bincount(
+            np.repeat(rows, lengths) * n + t_rows[positions],
+            weights=np.repeat(weights, lengths) * t_data[positions],
+            minlength=(stop - start) * n,
+        ).reshape(stop - start, n)
+        sim[np.arange(stop - start), np.arange(start, stop)] = -1.0
+        top = np.argpartition(-sim, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(sim, top, axis=1)
+        ranked = np.argsort(-top_scores, axis=1)
+        neighbours[start:stop] = np.take_along_axis(top, ranked, axis=1)
+        scores[start:stop] = np.take_along_axis(top_scores, ranked, axis=1)
+    return neighbours, scores
+
+
+def get_doc_similarity(doc_id: str) -> Dict[str, Any]:
+    """Cached top neighbours for every chunk of a book."""
+    dataset = restore_data()
+    topic = next(
+        (name for name, meta in dataset.get("booksMeta", {}).items()
+         if isinstance(meta, dict) and meta.get("id") == doc_id),
+        None,
+    )
+    if topic is None or topic not in dataset["entriesByTopic"]:
+        raise HTTPException(status_code=404, detail="کتاب موردنظر یافت نشد")
+
+    chunks = [c for c in dataset["entriesByTopic"][topic] if isinstance(c, dict) and "id" in c]
+    texts = [c.get("input") if isinstance(c.get("input"), str) else "" for c in chunks]
+    digest = hashlib.sha1(f"{SIMILARITY_MAX_K}\0{SIMILARITY_MAX_DF}\0".encode("utf-8"))
+    for chunk, text in zip(chunks, texts):
+        digest.update(f"{chunk['id']}\0{text}\0".encode("utf-8"))
+    key = digest.hexdigest()
+
+    cached = lru_get(_similarity_cache, doc_id)
+    cache_path = SIMILARITY_DIR / f"{doc_id}.json"
+    if (cached is None or cached.get("key") != key) and cache_path.exists():
+        try:
+            cached = load_json(cache_path)
+        except Exception:
+            cached = None
+    hit = cached is not None and cached.get("key") == key
+    record_cache("similarity", hit)
+    if not hit:
+        def build() -> Dict[str, Any]:
+            with span("terms"):
+                documents = [chunk_terms(text) for text in texts]
+            with span("similarity"):
+                neighbours, scores = top_k_similar(*tfidf_rows(documents), SIMILARITY_MAX_K)
+            ids = [c["id"] for c in chunks]
+            result = {
+                "key": key,
+                "neighbours": {
+                    ids[i]: [[ids[j], round(float(s), 4)] for j, s in zip(row, row_scores) if s > 0]
+                    for i, (row, row_scores) in enumerate(zip(neighbours, scores))
+                },
+            }
+            SIMILARITY_DIR.mkdir(parents=True, exist_ok=True)
+            dump_json(result, cache_path)
+            return result
+
+        # Concurrent requests for the same texts wait for one computation
+        cached = single_flight("similarity", f"{doc_id}:{key}", build)
+    lru_put(_similarity_cache, doc_id, cached, SIMILARITY_MEMORY_CACHE)
+    return {**cached, "cached": hit}
+
+
+@app.get("/suggest_links/{doc_id}")
+def suggest_links(doc_id: str, k: int = 5, min_score: float = 0.2, limit: int = 200) -> Dict[str, Any]:
+    """Candidate source/target pairs for a book, most similar first.
+
+    Each chunk contributes its k nearest chunks; pairs already linked in
+    either direction are left out. Nothing is written; accepted pairs are
+    saved through the normal graph sync.
+    """
+    if np is None:
+        raise HTTPException(status_code=503, detail="numpy is required for link suggestions")
+    if not DOC_ID_RE.match(doc_id):
+        raise HTTPException(status_code=400, detail="فیلد docId نامعتبر است")
+    if not 1 <= k <= SIMILARITY_MAX_K:
+        raise HTTPException(status_code=400, detail=f"k باید بین 1 و {SIMILARITY_MAX_K} باشد")
+    similarity = get_doc_similarity(doc_id)
+
+    connections = restore_graph_data()["graphConnections"].get(doc_id) or []
+    linked = {
+        frozenset((c.get("source"), c.get("target")))
+        for c in connections if isinstance(c, dict)
+    }
+    # Pairs point from the earlier chunk to the later one
+    position = {chunk_id: i for i, chunk_id in enumerate(similarity["neighbours"])}
+    best: Dict[Tuple[str, str], float] = {}
+    for source, neighbours in similarity["neighbours"].items():
+        for target, score in neighbours[:k]:
+            pair = (source, target) if position[source] < position[target] else (target, source)
+            if score >= min_score and frozenset(pair) not in linked and score > best.get(pair, 0):
+                best[pair] = score
+    ranked = sorted(best.items(), key=lambda item: -item[1])[:max(0, limit)]
+    return {
+        "docId": doc_id,
+        "cached": similarity["cached"],
+        "candidates": [
+            {"source": source, "target": target, "score": score}
+            for (source, target), score in ranked
+        ],
+    }
+
+
 def get_backup_metadata() -> Dict[str, Any]:
     """Load backup metadata from file."""
     if not BACKUP_METADATA_FILE.exists():
@@ -245,7 +2550,6 @@ def cleanup_old_backups(metadata: Dict[str, Any]) -> None:
     metadata["backups"] = backups_to_keep
 
 
-@app.get("/export")
 def export_all_data() -> Dict[str, Any]:
     """Export all data including entries and graph connections.
 
@@ -276,6 +2580,149 @@ def export_all_data() -> Dict[str, Any]:
     return export_data
 
 
+@app.get("/export")
+def serve_export() -> Response:
+    """Full export (export_all_data), shared by concurrent requests."""
+    return coalesced_json("export", export_all_data)
+
+
+# Columnar export for analytics (pandas, DuckDB). Topic files are read one
+# at a time and rows are flushed every COLUMNAR_BATCH_ROWS, each flush
+# becoming a Parquet row group or an Arrow IPC record batch, so memory is
+# bounded by the largest topic rather than the corpus. Low-cardinality
+# columns are dictionary encoded and everything is zstd compressed. Arrow
+# output uses the IPC stream format, which allows a new dictionary per batch.
+# order is float64 since chunks inserted in the UI get fractional orders.
+EXPORTS_DIR = BASE_DIR / "cache" / "exports"
+COLUMNAR_BATCH_ROWS = 64 * 1024
+COLUMNAR_FORMATS = {"parquet": ".parquet", "arrow": ".arrows"}
+
+
+def columnar_schemas() -> Dict[str, Any]:
+    label = pa.dictionary(pa.int32(), pa.string())
+    return {
+        "chunks": pa.schema([
+            ("docId", label), ("topic", label), ("id", pa.string()), ("order", pa.float64()),
+            ("depth", pa.int64()), ("text", pa.string()), ("output", pa.string()),
+        ]),
+        "edges": pa.schema([
+            ("docId", label), ("id", pa.string()), ("source", pa.string()),
+            ("target", pa.string()), ("type", label), ("createdAt", pa.int64()),
+            ("userDefined", pa.bool_()),
+        ]),
+    }
+
+
+def iter_topic_files():
+    """Yield (topic, doc_id, entries) per topic without loading them all."""
+    manifest_path = JSON_DATA_DIR / "manifest.json"
+    manifest = load_json(manifest_path, cached=True) if manifest_path.exists() else {}
+    topic_index = manifest.get("topicIndex")
+    if topic_index is None:
+        # Legacy layout: names and ids come from restore_data
+        dataset = restore_data()
+        for topic, entries in dataset["entriesByTopic"].items():
+            meta = dataset["booksMeta"].get(topic)
+            yield topic, meta.get("id") if isinstance(meta, dict) else None, entries
+        return
+    for topic, doc_id in topic_index.items():
+        try:
+            yield topic, doc_id, load_json(topic_path(doc_id))
+        except Exception:
+            continue
+
+
+def iter_columnar_rows(table: str):
+    def number(value):
+        return value if type(value) in (int, float) else None
+
+    def integer(value):
+        return int(value) if type(value) in (int, float) else None
+
+    if table == "chunks":
+        for topic, doc_id, entries in iter_topic_files():
+            for e in entries if isinstance(entries, list) else []:
+                if isinstance(e, dict):
+                    yield (doc_id, topic, e.get("id"), number(e.get("order")), integer(e.get("depth")),
+                           e.get("input"), e.get("output"))
+    else:
+        graph_data_path = GRAPH_DATA_DIR / "graph_data.json"
+        graph_data = load_json(graph_data_path, cached=True) if graph_data_path.exists() else {}
+        for doc_id, conns in (graph_data.get("graphConnections") or {}).items():
+            for c in conns if isinstance(conns, list) else []:
+                if isinstance(c, dict):
+                    yield (doc_id, c.get("id"), c.get("source"), c.get("target"),
+                           c.get("type") or "default", integer(c.get("createdAt")),
+                           c.get("userDefined") if type(c.get("userDefined")) is bool else None)
+
+
+def write_columnar(table: str, fmt: str, path: Path) -> int:
+    """Write one table to path batch by batch; returns the row count."""
+    schema = columnar_schemas()[table]
+    if fmt == "parquet":
+        writer = pq.ParquetWriter(str(path), schema, compression="zstd", use_dictionary=True)
+    else:
+        writer = pa.ipc.new_stream(
+            str(path), schema, options=pa.ipc.IpcWriteOptions(compression="zstd")
+        )
+    rows = 0
+    columns: List[List[Any]] = [[] for _ in schema]
+
+    def flush() -> None:
+        batch = pa.record_batch(
+            [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+            schema=schema,
+        )
+        writer.write_batch(batch)
+        for values in columns:
+            values.clear()
+
+    try:
+        for row in iter_columnar_rows(table):
+            for values, value in zip(columns, row):
+                values.append(value)
+            rows += 1
+            if len(columns[0]) >= COLUMNAR_BATCH_ROWS:
+                flush()
+        if columns[0] or not rows:
+            flush()
+    finally:
+        writer.close()
+    return rows
+
+
+@app.get("/export_columnar/{table}")
+def export_columnar(table: str, format: str = "parquet") -> FileResponse:
+    """Download chunks or edges as a Parquet file or an Arrow IPC stream."""
+    if pa is None:
+        raise HTTPException(status_code=503, detail="pyarrow is required for columnar export")
+    if table not in ("chunks", "edges"):
+        raise HTTPException(status_code=404, detail="table must be chunks or edges")
+    if format not in COLUMNAR_FORMATS:
+        raise HTTPException(status_code=400, detail="format must be parquet or arrow")
+
+    EXPORTS_DIR.mkdir(parents=True, exist_ok=True)
+    suffix = COLUMNAR_FORMATS[format]
+    fd, tmp_name = tempfile.mkstemp(prefix=f"{table}_", suffix=suffix, dir=EXPORTS_DIR)
+    os.close(fd)
+    try:
+        with span("columnar"):
+            write_columnar(table, format, Path(tmp_name))
+    except Exception:
+        os.unlink(tmp_name)
+        raise
+    media_type = (
+        "application/vnd.apache.parquet" if format == "parquet"
+        else "application/vnd.apache.arrow.stream"
+    )
+    return FileResponse(
+        tmp_name,
+        media_type=media_type,
+        filename=f"rooster_{table}{suffix}",
+        background=BackgroundTask(os.unlink, tmp_name),
+    )
+
+
 @app.post("/import")
 def import_all_data(payload: Dict[str, Any]) -> Dict[str, Any]:
     """Import all data including entries and graph connections.
@@ -296,6 +2743,35 @@ def import_all_data(payload: Dict[str, Any]) -> Dict[str, Any]:
     books_meta = payload.get("booksMeta", {})
     graph_connections = payload.get("graphConnections", {})
 
+    # Validate everything up front so nothing is written for a bad file;
+    # edges must point at chunks of the book (topic) owning their docId
+    errors: List[Dict[str, str]] = []
+    chunk_ids_by_topic: Dict[str, set] = {}
+    if type(entries_by_topic) is not dict:
+        errors.append({"path": "entriesByTopic", "message": "must be an object"})
+    else:
+        for topic, entries in entries_by_topic.items():
+            chunk_ids_by_topic[topic] = validate_chunks(
+                entries, f"entriesByTopic[{topic!r}]", errors
+            )
+    validate_books_meta(books_meta, "booksMeta", errors)
+    if type(graph_connections) is not dict:
+        errors.append({"path": "graphConnections", "message": "must be an object"})
+    else:
+        topic_by_doc_id = {
+            meta["id"]: topic
+            for topic, meta in (books_meta if type(books_meta) is dict else {}).items()
+            if type(meta) is dict and meta.get("id")
+        }
+        for doc_id, connections in graph_connections.items():
+            validate_connections(
+                connections,
+                f"graphConnections[{doc_id!r}]",
+                errors,
+                chunk_ids_by_topic.get(topic_by_doc_id.get(doc_id)),
+            )
+    raise_for_errors(errors)
+
     # Save entries data using existing sync endpoint logic
     if entries_by_topic:
         sync_payload = {
@@ -359,104 +2835,390 @@ def import_gemini_book(payload: Dict[str, Any]) -> Dict[str, Any]:
     if not chunks:
         raise HTTPException(status_code=400, detail="فیلد chunks نمی‌تواند خالی باشد")
 
-    # Sanitize book name for filename
-    safe_name = (
-        "".join(c for c in book_name if c.isalnum() or c in ("-", "_", " "))
-        .strip()
-        .replace(" ", "_")
-    )
-    if not safe_name:
-        safe_name = "book"
+    with span("validate"):
+        errors: List[Dict[str, str]] = []
+        chunk_ids = validate_chunks(chunks, "chunks", errors)
+        if type(graph_connections) is not dict:
+            errors.append({"path": "graphConnections", "message": "must be an object"})
+        elif doc_id in graph_connections:
+            validate_connections(
+                graph_connections[doc_id], f"graphConnections[{doc_id!r}]", errors, chunk_ids
+            )
+        raise_for_errors(errors)
+
+    # The docId is the storage key, so it must be safe as a filename
+    if not isinstance(doc_id, str) or not DOC_ID_RE.match(doc_id):
+        raise HTTPException(status_code=400, detail="فیلد docId نامعتبر است")
 
     # Create directories
     JSON_DATA_DIR.mkdir(parents=True, exist_ok=True)
+    TOPICS_DIR.mkdir(parents=True, exist_ok=True)
     GRAPH_DATA_DIR.mkdir(parents=True, exist_ok=True)
 
-    # Save chunks to json_data/<book_name>.json
-    book_file_path = JSON_DATA_DIR / f"{safe_name}.json"
-    with book_file_path.open("w", encoding="utf-8") as f:
-        json.dump(chunks, f, ensure_ascii=False, indent=2)
+    manifest_path = JSON_DATA_DIR / "manifest.json"
+    with span("manifest"):
+        with span("read"):
+            if manifest_path.exists():
+                manifest = load_json(manifest_path)
+                if "topicIndex" not in manifest:
+                    migrate_legacy_topics(manifest)
+                    dump_json(manifest, manifest_path)
+            else:
+                manifest = {
+                    "currentTopic": None,
+                    "orderCounters": {},
+                    "topicMeta": {},
+                    "booksMeta": {},
+                    "topics": [],
+                    "topicIndex": {},
+                    "files": []
+                }
+
+    # Save chunks to json_data/topics/<docId>.json
+    previous_ids = doc_chunk_ids()
+    book_file_path = topic_path(doc_id)
+    with span("chunks"):
+        dump_json(chunks, book_file_path)
 
     # Find max order for orderCounter
     max_order = max(chunk.get("order", 0) for chunk in chunks) if chunks else 0
 
     # Update manifest.json
-    manifest_path = JSON_DATA_DIR / "manifest.json"
-    if manifest_path.exists():
-        manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
-    else:
-        manifest = {
-            "currentTopic": None,
-            "orderCounters": {},
-            "topicMeta": {},
-            "booksMeta": {},
-            "topics": [],
-            "files": []
-        }
+    with span("manifest"):
+        # Add book metadata
+        with span("modify"):
+            topic_index = manifest["topicIndex"]
+            # Re-importing a docId under a new name renames the topic
+            for old_name in [n for n, i in topic_index.items() if i == doc_id and n != book_name]:
+                del topic_index[old_name]
+                manifest["booksMeta"].pop(old_name, None)
+                manifest["orderCounters"].pop(old_name, None)
+                if old_name in manifest["topics"]:
+                    manifest["topics"].remove(old_name)
+                if manifest.get("currentTopic") == old_name:
+                    manifest["currentTopic"] = book_name
+
+            manifest["booksMeta"][book_name] = {
+                "id": doc_id,
+                "name": book_name,
+                "created": int(time.time() * 1000)  # timestamp in milliseconds
+            }
+
+            # Update topics, index and files
+            if book_name not in manifest["topics"]:
+                manifest["topics"].append(book_name)
+            topic_index[book_name] = doc_id
+            manifest["files"] = [f"topics/{i}.json" for i in topic_index.values()]
+
+            # Update order counter
+            manifest["orderCounters"][book_name] = max_order
+
+            # Set as current topic if it's the first book
+            if not manifest.get("currentTopic"):
+                manifest["currentTopic"] = book_name
+
+        # Save manifest
+        with span("write"):
+            dump_json(manifest, manifest_path)
 
-    # Add book metadata
-    manifest["booksMeta"][book_name] = {
-        "id": doc_id,
-        "name": book_name,
-        "created": int(time.time() * 1000)  # timestamp in milliseconds
+    # Save graph connections
+    with span("graph"):
+        graph_data_path = GRAPH_DATA_DIR / "graph_data.json"
+        with span("read"):
+            if graph_data_path.exists():
+                graph_data = load_json(graph_data_path)
+            else:
+                graph_data = {
+                    "booksMeta": {},
+                    "graphConnections": {},
+                    "lastSync": {}
+                }
+
+        # Update graph data
+        with span("modify"):
+            graph_data["booksMeta"][book_name] = {
+                "id": doc_id,
+                "name": book_name,
+                "created": int(time.time() * 1000)
+            }
+
+            # Merge graph connections
+            if graph_connections:
+                if doc_id not in graph_data["graphConnections"]:
+                    graph_data["graphConnections"][doc_id] = []
+
+                # Replace existing connections for this docId
+                graph_data["graphConnections"][doc_id] = graph_connections.get(doc_id, [])
+
+            # Drop edges to chunks a re-import removed and collapse duplicates
+            tombstones = record_deletions(
+                previous_ids, {doc_id: chunk_ids}, set(topic_index.values()), set()
+            )
+            removed = collect_edge_garbage(
+                graph_data["graphConnections"], not_deleted(tombstones), set(), {doc_id}
+            )
+
+        # Save graph data
+        with span("write"):
+            dump_json(graph_data, graph_data_path)
+    refresh_overview()
+    refresh_corpus_stats()
+
+    return {
+        "status": "ok",
+        "message": f"کتاب «{book_name}» با موفقیت اضافه شد",
+        "bookName": book_name,
+        "docId": doc_id,
+        "chunksCount": len(chunks),
+        "graphConnectionsCount": len(graph_connections.get(doc_id, [])),
+        "filePath": f"topics/{book_file_path.name}",
+        "removedEdges": removed,
     }
 
-    # Update topics and files
-    if book_name not in manifest["topics"]:
-        manifest["topics"].append(book_name)
-    if f"{safe_name}.json" not in manifest["files"]:
-        manifest["files"].append(f"{safe_name}.json")
 
-    # Update order counter
-    manifest["orderCounters"][book_name] = max_order
+# Re-chunking: bring chunk sizes into a [minSize, maxSize] window around a
+# target, measured in words or estimated tokens (see estimate_tokens).
+# Oversized chunks are split at sentence ends (. ! ? ؟ … and line breaks,
+# keeping closing quotes such as » with their sentence); runs of small
+# chunks at the same depth are merged. The first piece of a split and the
+# first chunk of a merge keep their id, so most edges need no remapping.
+SENTENCE_RE = re.compile(r"\S.*?(?:[.!?؟…]+[\"'»”)\]]*(?=\s|$)|(?=\n)|$)")
+CHUNK_ID_CHARS = string.ascii_letters + string.digits + "$#*_"
+RECHUNK_POOL_MIN_CHUNKS = 2000  # smaller jobs are not worth the process pool
+
+
+def new_chunk_id(taken: set) -> str:
+    """Random id in the same format as randomId() in script.js."""
+    while True:
+        chunk_id = "".join(random.choices(CHUNK_ID_CHARS, k=12))
+        if chunk_id not in taken:
+            taken.add(chunk_id)
+            return chunk_id
+
+
+def split_text(text: str, measure, target: int) -> List[str]:
+    """Pack whole sentences into pieces of about target size."""
+    units: List[Tuple[str, int]] = []
+    for sentence in SENTENCE_RE.findall(text):
+        size = measure(sentence)
+        if size <= target:
+            units.append((sentence, size))
+            continue
+        # A sentence longer than the target is cut between words
+        words = sentence.split()
+        step = max(1, len(words) * target // size)
+        for i in range(0, len(words), step):
+            part = " ".join(words[i:i + step])
+            units.append((part, measure(part)))
+
+    pieces: List[List[str]] = []
+    size = 0
+    for sentence, sentence_size in units:
+        if pieces and size + sentence_size <= target:
+            pieces[-1].append(sentence)
+            size += sentence_size
+        else:
+            pieces.append([sentence])
+            size = sentence_size
+    return [" ".join(piece) for piece in pieces]
+
+
+def rechunk_entries(entries: List[Dict[str, Any]], options: Dict[str, Any]) -> Dict[str, Any]:
+    """Split and merge one topic's chunks; runs in a worker process."""
+    measure = (lambda text: len(text.split())) if options["unit"] == "words" else estimate_tokens
+    target, min_size, max_size = options["target"], options["minSize"], options["maxSize"]
+    taken = {e["id"] for e in entries}
+    ordered = sorted(entries, key=lambda e: e["order"])
+
+    # Split oversized chunks; pieces get fresh ids after the first
+    pieces: List[Tuple[Dict[str, Any], int]] = []
+    splits = []
+    for entry in ordered:
+        text = entry.get("input") or ""
+        size = measure(text)
+        if size <= max_size:
+            pieces.append((entry, size))
+            continue
+        parts = split_text(text, measure, target)
+        if len(parts) > 1 and measure(parts[-1]) < min_size:
+            parts[-2:] = [parts[-2] + " " + parts[-1]]
+        ids = [entry["id"]] + [new_chunk_id(taken) for _ in parts[1:]]
+        for i, (chunk_id, part) in enumerate(zip(ids, parts)):
+            piece = {**entry, "id": chunk_id, "input": part}
+            if i:
+                piece["output"] = ""
+            pieces.append((piece, measure(part)))
+        splits.append({"id": entry["id"], "into": ids, "sizes": [measure(p) for p in parts]})
+
+    # Merge runs of small chunks that share a depth, staying under maxSize
+    result: List[Dict[str, Any]] = []
+    id_map: Dict[str, str] = {}
+    merges = []
+    current, current_size, merged = None, 0, []
+    for piece, size in pieces + [(None, 0)]:
+        if (
+            current is not None and piece is not None
+            and (current_size < min_size or size < min_size)
+            and current_size + size <= max_size
+            and current.get("depth") == piece.get("depth")
+        ):
+            current = {
+                **current,
+                "input": current.get("input", "") + "\n\n" + piece.get("input", ""),
+                "output": "\n\n".join(o for o in (current.get("output"), piece.get("output")) if o),
+            }
+            current_size += size
+            merged.append(piece["id"])
+            id_map[piece["id"]] = current["id"]
+            continue
+        if current is not None:
+            result.append(current)
+            if merged:
+                merges.append({"id": current["id"], "from": [current["id"]] + merged,
+                               "size": current_size})
+        current, current_size, merged = piece, size, []
 
-    # Set as current topic if it's the first book
-    if not manifest.get("currentTopic"):
-        manifest["currentTopic"] = book_name
+    # Renumber; untouched chunks are copied only when their order moves
+    result = [e if e["order"] == i else {**e, "order": i} for i, e in enumerate(result, start=1)]
+    return {"entries": result, "idMap": id_map, "splits": splits, "merges": merges}
 
-    # Save manifest
-    with manifest_path.open("w", encoding="utf-8") as f:
-        json.dump(manifest, f, ensure_ascii=False, indent=2)
 
-    # Save graph connections
-    graph_data_path = GRAPH_DATA_DIR / "graph_data.json"
-    if graph_data_path.exists():
-        graph_data = json.loads(graph_data_path.read_text(encoding="utf-8"))
-    else:
-        graph_data = {
-            "booksMeta": {},
-            "graphConnections": {},
-            "lastSync": {}
+def remap_connections(connections: Any, id_map: Dict[str, str]) -> Tuple[Any, int, int]:
+    """Point edges at surviving chunk ids.
+
+    Edges that a merge turns into self-loops or duplicates are dropped.
+    """
+    remapped = dropped = 0
+    result: Dict[str, List[Dict[str, Any]]] = {}
+    for doc_id, conns in connections.items():
+        seen = set()
+        kept = []
+        for conn in conns:
+            if not isinstance(conn, dict):
+                kept.append(conn)
+                continue
+            source = id_map.get(conn.get("source"), conn.get("source"))
+            target = id_map.get(conn.get("target"), conn.get("target"))
+            key = (source, target, conn.get("type"))
+            if (source, target) != (conn.get("source"), conn.get("target")):
+                if source == target or key in seen:
+                    dropped += 1
+                    continue
+                conn = {**conn, "source": source, "target": target}
+                remapped += 1
+            seen.add(key)
+            kept.append(conn)
+        result[doc_id] = kept
+    return result, remapped, dropped
+
+
+@app.post("/rechunk")
+def rechunk_topics(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Split oversized and merge undersized chunks to a target size.
+
+    Expected JSON example:
+    {
+      "topics": ["Topic A"],        # optional, defaults to every topic
+      "target": 300,                # window target
+      "unit": "words",              # or "tokens"
+      "minSize": 100,               # optional, defaults to target / 3
+      "maxSize": 450,               # optional, defaults to target * 1.5
+      "dryRun": true                # default; false writes the result
+    }
+    """
+    target = payload.get("target", 300)
+    unit = payload.get("unit", "words")
+    if type(target) is not int or target < 1:
+        raise HTTPException(status_code=400, detail="فیلد target باید عدد صحیح مثبت باشد")
+    if unit not in ("words", "tokens"):
+        raise HTTPException(status_code=400, detail="فیلد unit باید words یا tokens باشد")
+    options = {
+        "target": target,
+        "unit": unit,
+        "minSize": payload.get("minSize", target // 3),
+        "maxSize": payload.get("maxSize", target * 3 // 2),
+    }
+    if not (type(options["minSize"]) is int and type(options["maxSize"]) is int
+            and 0 <= options["minSize"] <= target <= options["maxSize"]):
+        raise HTTPException(status_code=400, detail="باید minSize <= target <= maxSize باشد")
+    dry_run = payload.get("dryRun", True) is not False
+
+    dataset = restore_data()
+    entries_by_topic = dataset["entriesByTopic"]
+    topics = payload.get("topics") or list(entries_by_topic)
+    missing = [t for t in topics if t not in entries_by_topic]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"موضوع یافت نشد: {', '.join(map(str, missing))}")
+
+    # Stored data was validated on write, but rechunking relies on ids and orders
+    errors: List[Dict[str, str]] = []
+    for topic in topics:
+        validate_chunks(entries_by_topic[topic], f"entriesByTopic[{topic!r}]", errors)
+    raise_for_errors(errors)
+
+    with span("rechunk"):
+        jobs = [entries_by_topic[topic] for topic in topics]
+        if len(jobs) > 1 and sum(map(len, jobs)) >= RECHUNK_POOL_MIN_CHUNKS:
+            workers = min(len(jobs), os.cpu_count() or 1)
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(rechunk_entries, jobs, [options] * len(jobs)))
+        else:
+            results = [rechunk_entries(entries, options) for entries in jobs]
+
+    id_map: Dict[str, str] = {}
+    report = {}
+    for topic, result in zip(topics, results):
+        id_map.update(result["idMap"])
+        report[topic] = {
+            "before": len(entries_by_topic[topic]),
+            "after": len(result["entries"]),
+            "splits": result["splits"],
+            "merges": result["merges"],
         }
 
-    # Update graph data
-    graph_data["booksMeta"][book_name] = {
-        "id": doc_id,
-        "name": book_name,
-        "created": int(time.time() * 1000)
+    graph = restore_graph_data()
+    connections, remapped, dropped = remap_connections(graph["graphConnections"], id_map)
+    response = {
+        "status": "ok",
+        "dryRun": dry_run,
+        "options": options,
+        "topics": report,
+        "edgesRemapped": remapped,
+        "edgesDropped": dropped,
     }
+    if dry_run or not any(r["splits"] or r["merges"] for r in report.values()):
+        return response
+
+    new_entries = dict(entries_by_topic)
+    order_counters = dict(dataset["orderCounters"])
+    for topic, result in zip(topics, results):
+        new_entries[topic] = result["entries"]
+        order_counters[topic] = len(result["entries"])
+    sync_data({
+        "entriesByTopic": new_entries,
+        "orderCounters": order_counters,
+        "currentTopic": dataset["currentTopic"],
+        "topicMeta": dataset["topicMeta"],
+        "booksMeta": dataset["booksMeta"],
+    })
+    if remapped or dropped:
+        sync_graph_data({"booksMeta": graph["booksMeta"], "graphConnections": connections})
+    return response
 
-    # Merge graph connections
-    if graph_connections:
-        if doc_id not in graph_data["graphConnections"]:
-            graph_data["graphConnections"][doc_id] = []
 
-        # Replace existing connections for this docId
-        graph_data["graphConnections"][doc_id] = graph_connections.get(doc_id, [])
+def preload_dataset() -> None:
+    """Parse the dataset into the JSON cache ahead of the first request.
 
-    # Save graph data
-    with graph_data_path.open("w", encoding="utf-8") as f:
-        json.dump(graph_data, f, ensure_ascii=False, indent=2)
+    run_production.py calls this in the gunicorn master before forking, so
+    workers start warm and share the parsed objects copy-on-write; their own
+    startup warm-up then only revalidates the cache.
+    """
+    warm_up_dataset()
 
-    return {
-        "status": "ok",
-        "message": f"کتاب «{book_name}» با موفقیت اضافه شد",
-        "bookName": book_name,
-        "docId": doc_id,
-        "chunksCount": len(chunks),
-        "graphConnectionsCount": len(graph_connections.get(doc_id, [])),
-        "filePath": str(book_file_path.name)
-    }
+    # Forked workers would otherwise each report the warm-up reads
+    with _metrics_lock:
+        _counters.clear()
+        _histograms.clear()
 
 
 @app.post("/backup")
@@ -499,22 +3261,28 @@ def create_backup() -> Dict[str, Any]:
     backup_filename = f"backup_{timestamp_str}.zip"
     backup_path = BACKUPS_DIR / backup_filename
 
+    backup_started = time.perf_counter()
     try:
         # Create ZIP file
-        with zipfile.ZipFile(backup_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            # Walk through json_data directory
-            for file_path in JSON_DATA_DIR.rglob('*'):
-                if file_path.is_file():
-                    # Add file to ZIP with relative path
-                    arcname = file_path.relative_to(JSON_DATA_DIR)
-                    zipf.write(file_path, arcname)
+        with span("zip"):
+            with zipfile.ZipFile(backup_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+                # Walk through json_data directory
+                for file_path in JSON_DATA_DIR.rglob('*'):
+                    if file_path.is_file():
+                        # Add file to ZIP with relative path
+                        arcname = file_path.relative_to(JSON_DATA_DIR)
+                        zipf.write(file_path, arcname)
+
+        backup_size = backup_path.stat().st_size
+        observe("rooster_backup_duration_seconds", time.perf_counter() - backup_started)
+        observe("rooster_backup_size_bytes", backup_size)
 
         # Update metadata
         metadata["backups"].append({
             "filename": backup_filename,
             "timestamp": current_time,
             "timestamp_str": timestamp_str,
-            "size_bytes": backup_path.stat().st_size
+            "size_bytes": backup_size
         })
         metadata["last_backup_time"] = current_time
 
@@ -543,4 +3311,9 @@ def create_backup() -> Dict[str, Any]:
 
 
 if __name__ == "__main__":  # pragma: no cover
+    if sys.argv[1:2] == ["fsck"]:
+        # python main.py fsck [--repair]
+        report = fsck(repair="--repair" in sys.argv[2:])
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        sys.exit(0 if report["ok"] or report["repaired"] else 1)
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)